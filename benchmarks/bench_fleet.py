@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Benchmark of the loader, topology walk and render paths on synthetic fleets
+
+Generates networks of growing size with benchmarks/fakenb.py and times
+loadVlans, collect_access_vlans, loadSwitchData and loadRouterData and full
+renders of a sample of the devices. Every phase starts from a fresh netbox
+cache generation, so memos and the topology graph are built inside it.
+
+The results are compared against a baseline saved with --save-baseline on
+the same machine; a phase more than --threshold slower than its baseline,
+or making more netbox calls, is a regression and fails the run.
+
+    python benchmarks/bench_fleet.py [-n DEVICES ...] [--depth N] [--save-baseline]
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "imfcfg"))
+
+# same import order as c3cfg, the loader re-exports the nbh it uses
+from imfcfg.vlans import *
+from imfcfg.interfaces import *
+from imfcfg.routing import iBGP4, iBGP6
+from imfcfg.loader import *
+from imfcfg.render import init_template, precompile_templates
+
+from fakenb import SyntheticNetbox
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "fleet-baseline.json")
+
+ROUTER_TEMPLATE = """{# c3cfg: router device_role router #}
+system { host-name {{ hostname }}; }
+interfaces {
+{% for i in coreifs + distifs + accessifs %}
+    {{ i.ifname }} { description "{{ i.remote|default("") }}"; }
+{% endfor %}
+    lo0 { unit 0 { family inet address {{ lo0.inet }}; family iso address {{ lo0.iso }}; } }
+{% for vid in active_vlans|sort %}{% set v = vlans[vid] %}{% if v.prefix4 %}
+    irb unit {{ vid }} { family inet address {{ v.prefix4.prefix|nethost(addr=lo0.node4) }}; }
+{% endif %}{% endfor %}
+}
+protocols { bgp { group ibgp {
+{% for n in iBGP4 %}    neighbor {{ net2ip(n) }};
+{% endfor %}} } }
+"""
+
+SWITCH_TEMPLATE = """{# c3cfg: switch device_role (access|distribution)-switch #}
+system { host-name {{ hostname }}; }
+interfaces {
+{% for i in accessifs %}
+    {{ i.ifname }} { description "{{ i.description }}"; unit 0 { family ethernet-switching {
+        vlan members [ {{ i.tagged|sort|join(" ") }} ]; native-vlan-id {{ i.untagged }}; } } }
+{% endfor %}
+}
+vlans {
+{% for vid in access_vlans|sort %}{% set v = vlans[vid] %}
+    {{ v.vid_name }} { vlan-id {{ vid }};{% if v.prefix4 %} l3-interface irb.{{ vid }}; /* {{ v.prefix4.prefix|nethost(addr=1) }} */{% endif %} }
+{% endfor %}
+}
+"""
+
+
+def spread(names, count):
+    """Returns count names evenly spread over names"""
+    if len(names) <= count:
+        return list(names)
+    step = len(names) / count
+    return [names[int(i * step)] for i in range(count)]
+
+
+def phase_functions(nb, switches, tpldir):
+    """Returns phase name -> (devices, function of a device name)"""
+    cachedir = os.path.join(tpldir, "cache")
+
+    def render():
+        loader, templateEnv = init_template(get_nb(), tpldir, cachedir)
+        register_prefix_globals(templateEnv)
+        precompile_templates(templateEnv, loader)
+
+        def render_device(device):
+            # the same steps as render_device of the frontend
+            tvars = {}
+            typ = loader.get_source_type(templateEnv, device)[0]
+            if typ == "router":
+                loadRouterData(tvars, device)
+                routers = get_nb().dev_by_role(ROLE_BORDER_ROUTER)
+                tvars.update(iBGP4=iBGP4(device, routers))
+                tvars.update(iBGP6=iBGP6(device, routers))
+            if typ == "switch":
+                loadSwitchData(tvars, device)
+            tvars.update(vlans=loadVlans())
+            tvars.update(prefixes=loadPrefixes())
+            return templateEnv.get_template(device).render(**tvars)
+
+        return render_device
+
+    return {
+        "loadVlans": (["-"], lambda: lambda name: loadVlans()),
+        "collect_access_vlans": (switches, lambda: collect_access_vlans),
+        "loadSwitchData": (
+            switches,
+            lambda: lambda name: loadSwitchData({}, name),
+        ),
+        "loadRouterData": (
+            nb.routers,
+            lambda: lambda name: loadRouterData({}, name),
+        ),
+        "render": (nb.routers + switches, render),
+    }
+
+
+def run_phase(nb, devices, setup):
+    """Runs a phase on a new netbox cache generation, returns the seconds it
+    took and the number of netbox calls it made"""
+    fresh = copy.copy(nb)
+    fresh.calls = Counter()
+    store_nb(fresh)
+    func = setup()
+    fresh.calls.clear()
+    start = time.perf_counter()
+    for name in devices:
+        func(name)
+    elapsed = time.perf_counter() - start
+    store_nb(None)
+    return elapsed, sum(fresh.calls.values())
+
+
+def compare(result, baseline, threshold):
+    """Returns the change against baseline and whether it is a regression"""
+    if not baseline:
+        return "-", False
+    ratio = result["seconds"] / baseline["seconds"] if baseline["seconds"] else 1.0
+    # some slack for the phases that take next to nothing
+    slower = ratio > 1 + threshold and result["seconds"] - baseline["seconds"] > 0.005
+    more_calls = result["calls"] > baseline["calls"]
+    change = "%.2fx" % (ratio,)
+    if more_calls:
+        change += " +%d calls" % (result["calls"] - baseline["calls"],)
+    return change, slower or more_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-n",
+        dest="sizes",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 5000, 20000],
+        help="number of devices of the generated networks",
+    )
+    parser.add_argument(
+        "--depth", type=int, default=3, help="depth of the access switch trees"
+    )
+    parser.add_argument(
+        "--ports", type=int, default=12, help="access ports per access switch"
+    )
+    parser.add_argument(
+        "--sample", type=int, default=50, help="switches timed per network"
+    )
+    parser.add_argument(
+        "-r", dest="rounds", type=int, default=3, help="best of this many runs"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the new baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="slowdown against the baseline counted as regression",
+    )
+    args = parser.parse_args()
+
+    params = dict(
+        depth=args.depth, ports=args.ports, sample=args.sample, seed=args.seed
+    )
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored.get("params") != params:
+            sys.stderr.write(
+                "baseline %s was made with %r, not compared\n"
+                % (args.baseline, stored.get("params"))
+            )
+        else:
+            baseline = stored["results"]
+
+    with tempfile.TemporaryDirectory(prefix="bench_fleet") as tpldir:
+        os.mkdir(os.path.join(tpldir, "cache"))
+        for name, data in [
+            ("router.j2", ROUTER_TEMPLATE),
+            ("switch.j2", SWITCH_TEMPLATE),
+        ]:
+            with open(os.path.join(tpldir, name), "w") as f:
+                f.write(data)
+
+        results = {}
+        regressions = 0
+        print(
+            "%8s %-22s %7s %10s %10s %8s %s"
+            % ("devices", "phase", "timed", "total", "per dev", "calls", "baseline")
+        )
+        for size in args.sizes:
+            start = time.perf_counter()
+            nb = SyntheticNetbox(size, args.depth, args.ports, args.seed)
+            switches = nb.distribution[:5] + spread(nb.access, max(0, args.sample - 5))
+            sys.stderr.write(
+                "generated %d devices in %.1fs\n" % (size, time.perf_counter() - start)
+            )
+
+            results[str(size)] = {}
+            for phase, (devices, setup) in phase_functions(
+                nb, switches, tpldir
+            ).items():
+                runs = [run_phase(nb, devices, setup) for _ in range(args.rounds)]
+                result = {
+                    "devices": len(devices),
+                    "seconds": min(elapsed for elapsed, calls in runs),
+                    "calls": runs[0][1],
+                }
+                results[str(size)][phase] = result
+                change, regressed = compare(
+                    result, baseline.get(str(size), {}).get(phase), args.threshold
+                )
+                regressions += regressed
+                print(
+                    "%8d %-22s %7d %9.3fs %8.2fms %8d %s%s"
+                    % (
+                        size,
+                        phase,
+                        len(devices),
+                        result["seconds"],
+                        result["seconds"] * 1000 / len(devices),
+                        result["calls"],
+                        change,
+                        "  REGRESSION" if regressed else "",
+                    )
+                )
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"params": params, "results": results}, f, indent=2)
+            f.write("\n")
+        sys.stderr.write("baseline saved to %s\n" % (args.baseline,))
+    elif regressions:
+        sys.stderr.write("%d phases regressed against the baseline\n" % (regressions,))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
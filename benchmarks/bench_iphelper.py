@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the IP template helpers on a router-like template
+
+Renders a template that computes gateway, node and mask addresses for every
+vlan, once with the helpers from imfcfg.util.iphelper and once with the
+previous ipaddress based implementation, and checks both render the same.
+
+    python benchmarks/bench_iphelper.py [-n VLANS] [-r ROUNDS]
+"""
+
+import argparse
+import ipaddress as ipaddr
+import os
+import sys
+import time
+
+import jinja2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from imfcfg.util import iphelper
+
+ROUTER_TEMPLATE = """
+{% for v in vlans %}
+interfaces irb unit {{ v.vid }} {
+    family inet address {{ v.prefix4|nethost(addr=nodeid + 3) }};
+    family inet address {{ v.prefix4|nethost(addr=1) }} {
+        virtual-gateway-address {{ v.prefix4|nethost(addr=1, nomask=True) }};
+        netmask {{ v.prefix4|nethost(mask=True) }};
+    }
+    family inet6 address {{ v.prefix6|nethost(addr=nodeid + 3) }};
+    family inet6 address {{ v.prefix6|nethost(addr=1) }};
+    dhcp-relay server {{ net2ip(v.prefix4|nethost(addr=2)) }};
+    network {{ v.prefix4|nethost(addr=0) }} next {{ v.prefix4|nethost(addr=1, offset=1) }};
+}
+{% endfor %}
+"""
+
+
+def ref_net2ip(n):
+    net = ipaddr.ip_interface(n)
+    return net.ip
+
+
+def ref_nethost(net, addr=None, offset=None, nomask=False, mask=False):
+    net = ipaddr.ip_interface(str(net))
+
+    if addr == 0:
+        net = ipaddr.ip_interface(
+            f"{net.network.network_address}/{net.network.prefixlen}"
+        )
+    elif addr is not None:
+        if addr == 1:
+            net = ipaddr.ip_interface(
+                f"{next(net.network.hosts())}/{net.network.prefixlen}"
+            )
+        else:
+            generator = net.network.hosts()
+            hosts = [next(generator) for _ in range(addr)]
+            net = ipaddr.ip_interface(f"{hosts[addr-1]}/{net.network.prefixlen}")
+
+    if offset is not None:
+        net = net + offset
+
+    if nomask:
+        return net.ip
+    if mask:
+        return net.netmask
+    return net
+
+
+def make_env(nethost, net2ip):
+    env = jinja2.Environment(trim_blocks=True, lstrip_blocks=True)
+    env.filters.update(nethost=nethost)
+    env.globals.update(nethost=nethost, net2ip=net2ip)
+    return env.from_string(ROUTER_TEMPLATE)
+
+
+def bench(tpl, tvars, rounds):
+    timings = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        out = tpl.render(**tvars)
+        timings.append(time.perf_counter() - start)
+    return out, timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="vlans", type=int, default=400)
+    parser.add_argument("-r", dest="rounds", type=int, default=5)
+    parser.add_argument("--node", dest="nodeid", type=int, default=20)
+    args = parser.parse_args()
+
+    vlans = [
+        {
+            "vid": 1000 + i,
+            "prefix4": "10.%d.%d.0/%d" % (i // 64, (i % 64) * 4, 22),
+            "prefix6": "2001:db8:%x::/64" % (1000 + i),
+        }
+        for i in range(args.vlans)
+    ]
+    tvars = {"vlans": vlans, "nodeid": args.nodeid}
+
+    ref_out, ref_times = bench(make_env(ref_nethost, ref_net2ip), tvars, args.rounds)
+    new_out, new_times = bench(
+        make_env(iphelper.nethost, iphelper.net2ip), tvars, args.rounds
+    )
+    if ref_out != new_out:
+        sys.stderr.write("output differs!\n")
+        sys.exit(1)
+
+    print("%d vlans, %d rounds, output identical" % (args.vlans, args.rounds))
+    for name, times in [("ipaddress", ref_times), ("iphelper", new_times)]:
+        print("%-10s first %.4fs  best %.4fs" % (name, times[0], min(times)))
+    print(
+        "speedup first %.1fx  best %.1fx"
+        % (ref_times[0] / new_times[0], min(ref_times) / min(new_times))
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Benchmark of the Junos config parsers on synthetic router configs
+
+Generates MX-like configs of growing size and parses them with
+imfcfg.junosparse.parse and, up to --ply-limit, with the ply grammar
+(ply_parse), checking both give the same Blob tree. The memory column is
+what the tree of parse keeps allocated, relative to the config size.
+
+    python benchmarks/bench_junosparse.py [-s KB ...] [--ply-limit KB]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from imfcfg import junosparse
+
+
+def interface(rnd, name):
+    units = []
+    for unit in range(rnd.randint(1, 4)):
+        units.append(
+            """        unit %d {
+            description "cust-%d {vlan %d} via a/b";
+            vlan-id %d;
+            family inet {
+                filter {
+                    input protect-re;
+                }
+                address 10.%d.%d.1/24;
+            }
+            family inet6 {
+                address 2001:db8:%x::1/64;
+            }
+        }
+"""
+            % (
+                unit,
+                rnd.randint(0, 9999),
+                unit,
+                100 + unit,
+                rnd.randint(0, 255),
+                rnd.randint(0, 255),
+                rnd.randint(0, 0xFFFF),
+            )
+        )
+    return """    %s {
+        description "uplink \\"%s\\"";
+        mtu 9192;
+%s    }
+""" % (
+        name,
+        name,
+        "".join(units),
+    )
+
+
+def bgp_group(rnd, n):
+    neighbors = "".join(
+        """            neighbor 192.0.2.%d {
+                description "peer %d";
+                peer-as %d;
+            }
+""" % (rnd.randint(1, 254), i, 64512 + rnd.randint(0, 1000))
+        for i in range(rnd.randint(2, 8))
+    )
+    return """        group peers-%d {
+            type external;
+            import [ peer-in reject-bogons ];
+%s        }
+""" % (
+        n,
+        neighbors,
+    )
+
+
+def make_config(size, seed=1):
+    """Returns a config of about size bytes"""
+    rnd = random.Random(seed)
+    interfaces = []
+    groups = []
+    length = 0
+    n = 0
+    while length < size:
+        name = "%s-%d/%d/%d" % (
+            rnd.choice(["ge", "xe", "et"]),
+            n // 48,
+            n // 12 % 4,
+            n % 12,
+        )
+        interfaces.append(interface(rnd, name))
+        if n % 10 == 0:
+            groups.append(bgp_group(rnd, n // 10))
+        length += len(interfaces[-1]) + (len(groups[-1]) if n % 10 == 0 else 0)
+        n += 1
+    return """## Last commit: 2023-12-27 10:00:00 UTC by noc
+version 21.4R3;
+system {
+    host-name mx1;
+    /* the / in comments are words of their own */
+    login {
+        message "welcome {to} the router";
+    }
+}
+interfaces {
+%s}
+protocols {
+    bgp {
+%s    }
+}
+""" % (
+        "".join(interfaces),
+        "".join(groups),
+    )
+
+
+def same_tree(a, b):
+    return (
+        a.value == b.value
+        and list(a.keys()) == list(b.keys())
+        and all(same_tree(a[k], b[k]) for k in a)
+    )
+
+
+def tree_memory(data):
+    """Returns the bytes allocated by the parse tree of data"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tree = junosparse.parse(data)
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del tree
+    return allocated
+
+
+def timed(func, data):
+    start = time.perf_counter()
+    tree = func(data)
+    return tree, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-s",
+        dest="sizes",
+        type=int,
+        nargs="+",
+        default=[16, 64, 256, 1024, 4096],
+        help="config sizes in KB",
+    )
+    parser.add_argument(
+        "--ply-limit",
+        type=int,
+        default=256,
+        help="largest size in KB parsed with ply too",
+    )
+    args = parser.parse_args()
+
+    # builds the ply tables outside of the measurements
+    junosparse.ply_parser()
+
+    print(
+        "%10s %8s %10s %8s %10s %8s"
+        % ("size", "blocks", "parse", "memory", "ply", "speedup")
+    )
+    for kb in args.sizes:
+        data = make_config(kb * 1024)
+        tree, elapsed = timed(junosparse.parse, data)
+        blocks = data.count("{")
+        memory = "%.1fx" % (tree_memory(data) / len(data),)
+        if kb <= args.ply_limit:
+            ply_tree, ply_elapsed = timed(junosparse.ply_parse, data)
+            if not same_tree(tree, ply_tree):
+                sys.stderr.write("parse trees differ for %d KB\n" % (kb,))
+                sys.exit(1)
+            print(
+                "%8dKB %8d %9.3fs %8s %9.3fs %7.1fx"
+                % (kb, blocks, elapsed, memory, ply_elapsed, ply_elapsed / elapsed)
+            )
+        else:
+            print(
+                "%8dKB %8d %9.3fs %8s %10s %8s"
+                % (kb, blocks, elapsed, memory, "-", "-")
+            )
+
+
+if __name__ == "__main__":
+    main()
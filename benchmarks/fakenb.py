@@ -0,0 +1,336 @@
+"""Deterministic synthetic netbox for the benchmarks
+
+SyntheticNetbox generates an event network of a given number of devices:
+routers cabled to each other and to every distribution switch, trees of
+access switches below the distribution switches up to a given depth, LAG
+uplinks, a few rings and access points. It answers the netbox calls of nbh
+and the loader from memory and counts them per method in calls.
+"""
+
+import random
+from collections import Counter
+
+LAG_TYPE = {"value": "lag", "label": "Link Aggregation Group (LAG)"}
+COPPER_TYPE = {"value": "1000base-t", "label": "1000BASE-T (1GE)"}
+FIBER_TYPE = {"value": "10gbase-x-sfpp", "label": "SFP+ (10GE)"}
+VIRTUAL_TYPE = {"value": "virtual", "label": "Virtual"}
+
+ACTIVE = {"value": "active", "label": "Active"}
+IPV4 = {"value": 4, "label": "IPv4"}
+IPV6 = {"value": 6, "label": "IPv6"}
+
+DEVICE_TYPES = {
+    "router": {"slug": "mx204", "display": "MX204"},
+    "distribution-switch": {"slug": "ex4650-48y", "display": "EX4650-48Y"},
+    "access-switch": {"slug": "ex2300-48p", "display": "EX2300-48P"},
+    "accesspoint": {"slug": "ap-505", "display": "AP-505"},
+}
+POE_TYPES = ("EX2300-48P",)
+
+# vlans from this vid on are layer 2 only, see Site.l2vlan
+L2_VLANS = (3500, 3501, 3502, 3503)
+
+
+class SyntheticNetbox(object):
+    """Synthetic netbox of about devices devices
+
+    Access switches hang below the distribution switches in trees at most
+    depth switches deep, every switch has ports access ports. The same
+    arguments always give the same network.
+    """
+
+    def __init__(self, devices=100, depth=3, ports=12, seed=1):
+        self.rnd = random.Random(seed)
+        self.calls = Counter()
+        self._id = 0
+        # name -> device, name -> [interfaces], lag id -> [members]
+        self._devices = {}
+        self._ifaces = {}
+        self._lag_members = {}
+        self._ips = {}
+        self._serials = {}
+        self._ports = {}
+
+        n_routers = 2 if devices < 1000 else 4
+        n_dist = max(1, devices // 50)
+        n_ap = devices // 10
+        n_access = max(1, devices - n_routers - n_dist - n_ap)
+
+        self._make_vlans(max(8, min(3000, devices // 10)))
+        self._make_core(n_routers, n_dist)
+        self._make_access(n_access, depth, ports)
+        self._make_aps(n_ap)
+
+    def _next_id(self):
+        self._id += 1
+        return self._id
+
+    def _make_vlans(self, count):
+        self._vlans = []
+        self._prefixes = []
+        for i in range(count):
+            vid = 100 + i
+            vlan = {
+                "id": self._next_id(),
+                "vid": vid,
+                "name": "vlan-%d" % (vid,),
+                "tags": [],
+                "group": None,
+            }
+            self._vlans.append(vlan)
+            self._prefixes.append(
+                {
+                    "id": self._next_id(),
+                    "prefix": "10.%d.%d.0/24" % (vid // 256, vid % 256),
+                    "family": IPV4,
+                    "status": ACTIVE,
+                    "vlan": {"vid": vid, "name": vlan["name"]},
+                    "custom_fields": {
+                        "firewall": {"label": "restricted"} if i % 7 == 0 else None,
+                        "dhcp": i % 5 != 0,
+                    },
+                }
+            )
+            if i % 4 == 0:
+                self._prefixes.append(
+                    {
+                        "id": self._next_id(),
+                        "prefix": "2001:db8:%x::/64" % (vid,),
+                        "family": IPV6,
+                        "status": ACTIVE,
+                        "vlan": {"vid": vid, "name": vlan["name"]},
+                        "custom_fields": {"firewall": None, "dhcp": None},
+                    }
+                )
+        for vid in L2_VLANS:
+            self._vlans.append(
+                {
+                    "id": self._next_id(),
+                    "vid": vid,
+                    "name": "l2-%d" % (vid,),
+                    "tags": [],
+                    "group": None,
+                }
+            )
+
+    def _device(self, name, role, **custom_fields):
+        id = self._next_id()
+        device = {
+            "id": id,
+            "name": name,
+            "serial": "SN%07d" % (id,),
+            "device_role": {"slug": role},
+            "role": {"slug": role},
+            "device_type": DEVICE_TYPES[role],
+            "primary_ip4": {
+                "address": "10.255.%d.%d/32"
+                % (len(self._devices) // 250, 1 + len(self._devices) % 250)
+            },
+            "primary_ip6": None,
+            "custom_fields": custom_fields,
+            "tags": [],
+        }
+        self._devices[name] = device
+        self._serials[device["serial"]] = device
+        self._ifaces[name] = []
+        return device
+
+    def _iface(self, device, name, type=COPPER_TYPE, **fields):
+        iface = {
+            "id": self._next_id(),
+            "name": name,
+            "device": {"name": device},
+            "type": type,
+            "enabled": True,
+            "mode": None,
+            "description": "",
+            "lag": None,
+            "tags": [],
+            "tagged_vlans": [],
+            "untagged_vlan": None,
+            "connected_endpoints": None,
+            "speed": None,
+            "mgmt_only": False,
+            "custom_fields": {"mclag": False, "ptp_upstream": False},
+        }
+        iface.update(fields)
+        self._ifaces[device].append(iface)
+        return iface
+
+    def _port(self, device, prefix="xe-0/1/", **fields):
+        key = (device, prefix)
+        self._ports[key] = self._ports.get(key, -1) + 1
+        return self._iface(
+            device,
+            "%s%d" % (prefix, self._ports[key]),
+            FIBER_TYPE if prefix.startswith("xe") else COPPER_TYPE,
+            **fields,
+        )
+
+    def _cable(self, a, b):
+        a["connected_endpoints"] = [
+            {"device": {"name": b["device"]["name"]}, "name": b["name"]}
+        ]
+        b["connected_endpoints"] = [
+            {"device": {"name": a["device"]["name"]}, "name": a["name"]}
+        ]
+
+    def _link(self, upper, lower, lag=False):
+        """Cables lower to upper, over a LAG of two members if lag"""
+        if not lag:
+            self._cable(self._port(upper), self._port(lower, tags=[{"name": "uplink"}]))
+            return
+        lags = []
+        for device in (upper, lower):
+            key = (device, "ae")
+            self._ports[key] = self._ports.get(key, -1) + 1
+            lags.append(self._iface(device, "ae%d" % (self._ports[key],), LAG_TYPE))
+        for _ in range(2):
+            members = [
+                self._port(device, lag={"name": lag_iface["name"]})
+                for device, lag_iface in zip((upper, lower), lags)
+            ]
+            self._cable(*members)
+            for member, lag_iface in zip(members, lags):
+                self._lag_members.setdefault(lag_iface["id"], []).append(member)
+
+    def _make_core(self, n_routers, n_dist):
+        self.routers = ["r%d" % (i + 1,) for i in range(n_routers)]
+        self.distribution = ["d%d" % (i + 1,) for i in range(n_dist)]
+        for name in self.routers:
+            self._device(name, "router")
+            self._iface(name, "lo0", VIRTUAL_TYPE)
+            for vlan in self._vlans[:4]:
+                self._iface(name, "irb.%d" % (vlan["vid"],), VIRTUAL_TYPE)
+            for _ in range(2):
+                self._port(name, "ge-0/0/")
+        for i, a in enumerate(self.routers):
+            for b in self.routers[i + 1 :]:
+                ends = (self._port(a, "et-0/0/"), self._port(b, "et-0/0/"))
+                self._cable(*ends)
+                net = len(self._ips)
+                for host, iface in enumerate(ends):
+                    self._ips[iface["id"]] = [
+                        {
+                            "address": "10.254.%d.%d/31"
+                            % (net // 128, net % 128 * 2 + host),
+                            "family": IPV4,
+                        },
+                        {
+                            "address": "2001:db8:ffff:%x::%d/127" % (net, host),
+                            "family": IPV6,
+                        },
+                    ]
+        for i, name in enumerate(self.distribution):
+            self._device(
+                name,
+                "distribution-switch",
+                default_access_vlan=self._vlans[i % len(self._vlans)]["vid"],
+            )
+            for router in self.routers:
+                self._link(router, name, lag=True)
+
+    def _make_access(self, count, depth, ports):
+        rnd = self.rnd
+        vids = [v["vid"] for v in self._vlans]
+        # switches new access switches can hang below, with their depth
+        parents = [(name, 0) for name in self.distribution]
+        children = {}
+        self.access = []
+        for i in range(count):
+            name = "a%d" % (i + 1,)
+            x = rnd.random()
+            if x < 0.1:
+                custom_fields = {}
+            elif x < 0.4:
+                custom_fields = {"default_access_vlan": rnd.choice(vids[:-4])}
+            else:
+                custom_fields = {"default_access_vlan": None}
+            self._device(name, "access-switch", **custom_fields)
+            if rnd.random() < 0.02:
+                parent, level = rnd.choice(self.routers), 0
+            else:
+                parent, level = rnd.choice(parents)
+            self._link(parent, name, lag=rnd.random() < 0.2)
+            children.setdefault(parent, []).append(name)
+            if level + 1 < depth:
+                parents.append((name, level + 1))
+
+            for _ in range(ports):
+                fields = {}
+                x = rnd.random()
+                if x < 0.2:
+                    fields["untagged_vlan"] = {"vid": rnd.choice(vids)}
+                elif x < 0.3:
+                    fields["tagged_vlans"] = [
+                        {"vid": vid} for vid in rnd.sample(vids, min(3, len(vids)))
+                    ]
+                elif x < 0.35:
+                    fields["enabled"] = False
+                elif x < 0.4:
+                    fields["mode"] = {"value": "tagged-all"}
+                self._port(name, "ge-0/0/", **fields)
+            if rnd.random() < 0.3:
+                self._iface(name, "vlan.%d" % (rnd.choice(L2_VLANS),), VIRTUAL_TYPE)
+            self.access.append(name)
+
+        # rings, redundant links between switches below the same parent
+        siblings = [names for names in children.values() if len(names) > 1]
+        for _ in range(min(len(siblings), count // 50)):
+            a, b = rnd.sample(rnd.choice(siblings), 2)
+            self._cable(self._port(a), self._port(b))
+
+    def _make_aps(self, count):
+        for i in range(count):
+            name = "ap%d" % (i + 1,)
+            self._device(name, "accesspoint")
+            self._cable(
+                self._port(self.rnd.choice(self.access), "ge-0/0/"),
+                self._port(name, "eth"),
+            )
+
+    @property
+    def switches(self):
+        return self.distribution + self.access
+
+    def dev_by_name(self, name):
+        self.calls["dev_by_name"] += 1
+        device = self._devices.get(name)
+        return [device] if device else []
+
+    def dev_by_serial(self, serial):
+        self.calls["dev_by_serial"] += 1
+        device = self._serials.get(serial)
+        return [device] if device else []
+
+    def dev_by_role(self, role):
+        self.calls["dev_by_role"] += 1
+        return [d for d in self._devices.values() if d["device_role"]["slug"] == role]
+
+    def devices(self):
+        self.calls["devices"] += 1
+        return list(self._devices.values())
+
+    def int_by_device_name(self, name):
+        self.calls["int_by_device_name"] += 1
+        return self._ifaces.get(name, [])
+
+    def lag_members_by_iface(self, iface):
+        self.calls["lag_members_by_iface"] += 1
+        return self._lag_members.get(iface["id"], [])
+
+    def ip_by_int_id(self, id):
+        self.calls["ip_by_int_id"] += 1
+        return self._ips.get(id, [])
+
+    def vlans(self):
+        self.calls["vlans"] += 1
+        return self._vlans
+
+    def prefixes(self):
+        self.calls["prefixes"] += 1
+        return self._prefixes
+
+    def has_poe(self, device_type):
+        self.calls["has_poe"] += 1
+        return device_type in POE_TYPES
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function
-from functools import namedtuple, reduce
+from functools import namedtuple, reduce, partial
 import argparse
 import ipaddress as ipaddr
 import jinja2
@@ -18,7 +18,9 @@ import random
 import string
 import shutil
 import csv
-from imfcfg.render import TemplateLoader, init_template
+import multiprocessing
+from imfcfg.render import TemplateLoader, init_template, precompile_templates
+from imfcfg.metrics import PhaseTimes
 from pprint import pprint
 from fnmatch import fnmatch
 from urllib.parse import urlencode
@@ -68,61 +70,151 @@ TRANSIT_SUBIF_RE = re.compile(r"(.*)\.(\d+)")
 
 
 def loadKeys(tvars):
-    db_path = config.get("db", "path")
-    with open(f"{db_path}/groups.yml", "r") as stream:
-        groups = yaml.safe_load(stream)
-        tvars.update(groups=groups)
-    with open(f"{db_path}/users.yml", "r") as stream:
-        users = yaml.safe_load(stream)
-        tvars.update(users=users)
-    with open(f"{db_path}/keys.yml", "r") as stream:
-        keys = yaml.safe_load(stream)
-        tvars.update(keys=keys)
-    with open(f"{db_path}/event-config.json", "r") as stream:
-        event_config = json.load(stream)
-        event_config["md5crypt_admin_password"] = hash_password(
-            event_config["admin_password"], "md5"
-        )
-        event_config["crypted_admin_password"] = hash_password(
-            event_config["admin_password"], "sha256"
-        )
-        tvars.update(event_config=event_config)
-    with open(f"{db_path}/access-users.json", "r") as stream:
-        access_users = json.load(stream)
-        tvars.update(access_users=access_users)
+    tvars.update(static_data_from_config(config).get())
 
 
 dbpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "netbox.cache-v2")
 
 
-def loadVars(device=None, tplname=None, loader=None):
+def loadVars(device=None, tplname=None, loader=None, phases=None):
+    """phases is the PhaseTimes the time of each step is added to"""
     tvars = {}
+    if phases is None:
+        phases = PhaseTimes()
 
     if tplname is None:
         tplname = device
 
-    typ, data, path, checkmodif = loader.get_source_type(templateEnv, tplname)
+    with phases.phase("get_source_type"):
+        typ, data, path, checkmodif = loader.get_source_type(templateEnv, tplname)
 
     # load ssh keys
-    loadKeys(tvars)
+    with phases.phase("loadKeys"):
+        loadKeys(tvars)
 
     # load router/switch specific data
     if typ == "router":
-        loadRouterData(tvars, device)
+        with phases.phase("loadRouterData"):
+            loadRouterData(tvars, device)
 
-        routers = nb.dev_by_role(ROLE_BORDER_ROUTER)
-        tvars.update(iBGP4=iBGP4(device, routers))
-        tvars.update(iBGP6=iBGP6(device, routers))
+            routers = nb.dev_by_role(ROLE_BORDER_ROUTER)
+            tvars.update(iBGP4=iBGP4(device, routers))
+            tvars.update(iBGP6=iBGP6(device, routers))
     if typ == "switch":
-        loadSwitchData(tvars, device)
+        with phases.phase("loadSwitchData"):
+            loadSwitchData(tvars, device)
 
-    tvars.update(vlans=loadVlans())
+    with phases.phase("loadVlans"):
+        tvars.update(vlans=loadVlans())
 
-    tvars.update(prefixes=loadPrefixes())
+        tvars.update(prefixes=loadPrefixes())
 
     return tplname, tvars
 
 
+def openNetbox(readonly):
+    global nb
+    nb = pynetbox(
+        config.get("global", "base_uri"),
+        config.get("global", "token"),
+        (config.get("global", "username"), config.get("global", "password")),
+        args.offline,
+        args.trace,
+        cachetime=config.get("global", "cachetime", fallback=15.0),
+        readonly=readonly,
+        dbpath=dbpath,
+    )
+    # with --trace every render reports the netbox calls it made
+    nb = store_nb(nb, dbpath, trace=args.trace)
+    return nb
+
+
+def refreshNetbox():
+    """refresh the whole netbox cache with a writable handle and close it
+    again, read-only render workers can't fetch expired or missing entries
+    themselves"""
+    if args.offline:
+        if not os.path.exists(dbpath):
+            sys.stderr.write(
+                "netbox cache %s does not exist, can't render offline\n" % (dbpath,)
+            )
+            sys.exit(1)
+        # serial offline renders can't fetch anything either
+        return
+    writer = pynetbox(
+        config.get("global", "base_uri"),
+        config.get("global", "token"),
+        (config.get("global", "username"), config.get("global", "password")),
+        args.offline,
+        args.trace,
+        cachetime=config.get("global", "cachetime", fallback=15.0),
+        readonly=False,
+        dbpath=dbpath,
+    )
+    writer.updater()
+    close_netbox(writer)
+
+
+def initTemplate():
+    cache_path = config.get("templates", "cache_path", fallback=None)
+    loader, templateEnv = init_template(
+        nb,
+        os.path.expanduser(config.get("templates", "path")),
+        cache_path and os.path.expanduser(cache_path),
+    )
+    register_prefix_globals(templateEnv)
+    return loader, templateEnv
+
+
+class WorkerInitError(Exception):
+    """a render worker could not open netbox or the templates"""
+
+
+workerError = None
+
+
+def initWorker():
+    """set up a render worker with its own read-only handle on the netbox cache"""
+    global loader, templateEnv, workerError
+    try:
+        openNetbox(True)
+        loader, templateEnv = initTemplate()
+    except (Exception, SystemExit):
+        # the pool would replace a worker failing here forever, the error is
+        # raised by its first render instead
+        workerError = traceback.format_exc()
+
+
+def renderDevice(name, outdir):
+    """render the config of a device to <outdir>/<name>.conf
+
+    The config is written to a temporary file first and renamed into place,
+    returns (name, seconds, error, {phase: seconds}, CallTrace)"""
+    if workerError is not None:
+        raise WorkerInitError(workerError)
+    start = time.time()
+    phases = PhaseTimes()
+    path = os.path.join(outdir, "%s.conf" % (name))
+    tmppath = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with tracing_calls() as calls:
+            template_file, locVars = loadVars(name, loader=loader, phases=phases)
+            with phases.phase("render"):
+                tpl = templateEnv.get_template(template_file)
+                rendered = tpl.render(**locVars)
+        with open(tmppath, "w") as fd:
+            print(rendered, file=fd)
+        os.replace(tmppath, path)
+    except:
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+        error = traceback.format_exc()
+        return name, time.time() - start, error, phases.times, calls
+    return name, time.time() - start, None, phases.times, calls
+
+
 if __name__ == "__main__":
     # load config
     global nb
@@ -169,6 +261,13 @@ if __name__ == "__main__":
     parser.add_argument(
         "-D", dest="outdir", type=str, help="output directory for multi-device mode"
     )
+    parser.add_argument(
+        "-j",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="render N devices in parallel in multi-device mode (uses the netbox cache read-only)",
+    )
     parser.add_argument(
         "-d", dest="daemon", action="store_const", const=True, help="run HTTP server"
     )
@@ -194,7 +293,14 @@ if __name__ == "__main__":
         dest="trace",
         action="store_const",
         const=True,
-        help="show IPAM requests with latency",
+        help="show IPAM requests with latency, the time spent per phase and the netbox calls made",
+    )
+    parser.add_argument(
+        "--compile",
+        dest="compile",
+        action="store_const",
+        const=True,
+        help="compile all templates into the bytecode cache",
     )
     parser.add_argument(
         "--interactive",
@@ -214,53 +320,97 @@ if __name__ == "__main__":
             datefmt="%Y-%m-%d:%H:%M:%S",
         )
 
-    nb = pynetbox(
-        config.get("global", "base_uri"),
-        config.get("global", "token"),
-        (config.get("global", "username"), config.get("global", "password")),
-        args.offline,
-        args.trace,
-        cachetime=config.get("global", "cachetime", fallback=15.0),
-        readonly=args.daemon,
-        dbpath=dbpath,
-    )
-    store_nb(nb)
+    # parallel workers open their own read-only handles on the cache, which
+    # can't coexist with a writer, so the cache is refreshed before
+    if args.jobs > 1 and not args.daemon:
+        refreshNetbox()
+    openNetbox(args.daemon or args.jobs > 1)
 
-    loader, templateEnv = init_template(
-        nb, os.path.expanduser(config.get("templates", "path"))
-    )
+    loader, templateEnv = initTemplate()
+
+    if args.compile:
+        count = precompile_templates(templateEnv, loader)
+        sys.stderr.write("compiled %d templates\n" % (count,))
+        sys.exit(0)
 
     if args.router:
         TemplateLoader.default_role = "router"
     elif args.switch:
         TemplateLoader.default_role = "switch"
 
+    phases = PhaseTimes()
+    calls = CallTrace()
     if args.template is not None:
-        template_file, locVars = loadVars(
-            args.router or args.switch, tplname=args.template, loader=loader
-        )
+        with tracing_calls(calls):
+            template_file, locVars = loadVars(
+                args.router or args.switch,
+                tplname=args.template,
+                loader=loader,
+                phases=phases,
+            )
     elif args.router or args.switch:
         devname = args.router or args.switch
         if "?" in devname or "*" in devname:
             outdir = args.outdir or "."
             devices = nb.devices()
+            names = []
             for device in devices:
                 if not fnmatch(device["name"], devname):
                     continue
                 if device["device_role"]["slug"] not in ["access-switch", "router"]:
                     continue
-                name = device["name"]
-                sys.stderr.write("writing %s.conf\n" % (name))
-                try:
-                    template_file, locVars = loadVars(name, loader=loader)
-                    tpl = templateEnv.get_template(template_file)
-                    with open(os.path.join(outdir, "%s.conf" % (name)), "w") as fd:
-                        print(tpl.render(**locVars), file=fd)
-                except:
-                    sys.stderr.write("error while rendering %s.conf:\n" % (name,))
-                    traceback.print_exc()
-            sys.exit(0)
-        template_file, locVars = loadVars(devname, loader=loader)
+                names.append(device["name"])
+
+            start = time.time()
+            if args.jobs > 1:
+                pool = multiprocessing.get_context("fork").Pool(
+                    args.jobs, initializer=initWorker
+                )
+                results = pool.imap_unordered(
+                    partial(renderDevice, outdir=outdir), names
+                )
+            else:
+                results = (renderDevice(name, outdir) for name in names)
+
+            timings = []
+            failures = []
+            try:
+                for name, elapsed, error, times, render_calls in results:
+                    timings.append((elapsed, name))
+                    phases.add(times)
+                    calls.update(render_calls)
+                    if error is None:
+                        sys.stderr.write("wrote %s.conf (%.2fs)\n" % (name, elapsed))
+                    else:
+                        failures.append(name)
+                        sys.stderr.write("error while rendering %s.conf:\n" % (name,))
+                        sys.stderr.write(error)
+            except WorkerInitError as e:
+                pool.terminate()
+                sys.stderr.write("render worker failed to start:\n%s" % (e,))
+                sys.exit(1)
+            if args.jobs > 1:
+                pool.close()
+                pool.join()
+
+            sys.stderr.write(
+                "%d devices rendered, %d failed in %.1fs\n"
+                % (len(timings) - len(failures), len(failures), time.time() - start)
+            )
+            if failures:
+                sys.stderr.write("failed: %s\n" % (", ".join(sorted(failures))))
+            slowest = sorted(timings, reverse=True)[:5]
+            if slowest:
+                sys.stderr.write(
+                    "slowest: %s\n"
+                    % (", ".join(["%s (%.2fs)" % (n, t) for t, n in slowest]))
+                )
+            if args.trace:
+                sys.stderr.write("phases: %s\n" % (phases.format(),))
+                sys.stderr.write(calls.report())
+            sys.exit(1 if failures else 0)
+        with tracing_calls(calls):
+            template_file, locVars = loadVars(devname, loader=loader, phases=phases)
     else:
         sys.stderr.write("need template (-t), router (-r) or switch (-s)\n")
         sys.exit(1)
@@ -285,5 +435,12 @@ if __name__ == "__main__":
         code.interact(local=shellvars)
         sys.exit(0)
 
-    tpl = templateEnv.get_template(template_file)
-    print(tpl.render(**locVars), file=args.output)
+    with tracing_calls(calls), phases.phase("render"):
+        tpl = templateEnv.get_template(template_file)
+        rendered = tpl.render(**locVars)
+    print(rendered, file=args.output)
+
+    if args.trace:
+        sys.stderr.write("upstream memo: %r\n" % (memo_stats(),))
+        sys.stderr.write("phases: %s\n" % (phases.format(),))
+        sys.stderr.write(calls.report())
@@ -49,12 +49,12 @@ from imfcfg.c3site import Site
 site = Site()
 
 from cachedpynetbox.nbcache.nbcache import SyncedNetbox
+from imfcfg.cli.sync import ChangeLog, SyncState, summarize_changes
+from imfcfg.snmp.audit import AUDIT_ROLES, LldpAudit, write_audit
+from imfcfg.snmp.tablewalk import snmp_cached_client_from_config
 
 
-@click.command()
-def updater():
-    # load config
-    global nb
+def read_config():
     cfg_defaults = {
         "base_uri": "https://localhost:443/api/",
         "token": "None",
@@ -72,9 +72,29 @@ def updater():
     except OSError:
         sys.stderr.write("%s file could not be opened, does it exist?" % userrcfile)
         sys.exit(1)
+    return config
+
+
+dbtruepath = os.path.join(os.path.dirname("/var/cache/imf/"), "netbox.cache-v2")
 
-    dbtruepath = os.path.join(os.path.dirname("/var/cache/imf/"), "netbox.cache-v2")
-    lastfullget = 0
+
+@click.command()
+def updater():
+    # load config
+    global nb
+    config = read_config()
+
+    interval = config.getfloat("updater", "interval", fallback=30.0)
+    full_interval = config.getfloat("updater", "full_interval", fallback=900.0)
+    # the netbox change log only tells whether anything changed since the
+    # last refresh, cycles without changes are skipped. A refresh still
+    # fetches the whole cache through cachedpynetbox.
+    state = SyncState(dbtruepath + ".sync")
+    changelog = None
+    if config.getboolean("updater", "skip_unchanged", fallback=True):
+        changelog = ChangeLog(
+            config.get("global", "base_uri"), config.get("global", "token")
+        )
     while True:
         dbpath = (
             dbtruepath
@@ -82,12 +102,38 @@ def updater():
             + "".join([random.choice(string.ascii_lowercase) for i in range(0, 16)])
         )
         try:
-            if time.time() - lastfullget > 900:
+            full = time.time() - state.last_full > full_interval or not os.path.exists(
+                dbtruepath
+            )
+            # newest change the refreshed cache will contain, looked up before
+            # refreshing so changes made during the refresh are seen next time
+            marker = None
+            if changelog is not None:
+                try:
+                    if full or state.last_id is None:
+                        marker = changelog.latest() or {"id": 0}
+                    else:
+                        changes = changelog.changes_since(
+                            state.last_id, state.last_time
+                        )
+                        if len(changes) == 0:
+                            time.sleep(interval)
+                            continue
+                        sys.stderr.write(
+                            "%d changes since last refresh: %s\n"
+                            % (len(changes), summarize_changes(changes))
+                        )
+                        marker = changes[-1]
+                except Exception:
+                    # can't tell what changed, refresh anyway
+                    traceback.print_exc()
+
+            if full:
                 sys.stderr.write(
-                    "1h passed (or startup), regenerating cache from scratch\n"
+                    "%ds passed (or startup), regenerating cache from scratch\n"
+                    % (full_interval,)
                 )
-                lastfullget = time.time()
-            elif os.path.exists(dbtruepath):
+            else:
                 shutil.copy2(dbtruepath, dbpath)
             nb = pynetbox(
                 config.get("global", "base_uri"),
@@ -103,6 +149,8 @@ def updater():
             nb._snb._cache.db.close()
             del nb
             os.rename(dbpath, dbtruepath)
+            state.update(marker, full=full)
+            state.save()
             print("refresh done")
         except:
             traceback.print_exc()
@@ -110,4 +158,74 @@ def updater():
                 os.unlink(dbpath)
             except:
                 pass
-        time.sleep(30)
+        time.sleep(interval)
+
+
+@click.command()
+@click.option(
+    "-d",
+    "--device",
+    "patterns",
+    multiple=True,
+    help="audit devices matching this glob, can be repeated (default: all)",
+)
+@click.option(
+    "--role",
+    "roles",
+    multiple=True,
+    default=AUDIT_ROLES,
+    show_default=True,
+    help="audit devices with this role, can be repeated",
+)
+@click.option(
+    "-f", "--format", "fmt", type=click.Choice(["json", "csv"]), default="json"
+)
+@click.option("-o", "--output", type=click.File("w"), default="-")
+@click.option(
+    "--deadline",
+    type=float,
+    default=300.0,
+    show_default=True,
+    help="seconds after which unfinished walks count as unreachable",
+)
+@click.option(
+    "--concurrency", type=int, default=None, help="walks in flight at the same time"
+)
+@click.option("--all", "show_all", is_flag=True, help="also report matching ports")
+def lldp_audit(patterns, roles, fmt, output, deadline, concurrency, show_all):
+    """Compare LLDP neighbours of all switches against netbox cabling"""
+    config = read_config()
+    nb = pynetbox(
+        config.get("global", "base_uri"),
+        config.get("global", "token"),
+        False,
+        False,
+        cachetime=config.get("global", "cachetime", fallback=15.0),
+        readonly=True,
+        dbpath=dbtruepath,
+        quick="semi",
+    )
+    options = {}
+    if concurrency:
+        options["concurrency"] = concurrency
+    client = snmp_cached_client_from_config(config, **options)
+
+    start = time.time()
+    audit = LldpAudit(nb, client)
+    devices = audit.devices(roles, patterns)
+    rows = audit.run(devices, deadline)
+
+    counts = {}
+    for row in rows:
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+    sys.stderr.write(
+        "audited %d devices in %.1fs: %s\n"
+        % (
+            len(devices),
+            time.time() - start,
+            ", ".join("%d %s" % (n, s) for s, n in sorted(counts.items())) or "-",
+        )
+    )
+    if not show_all:
+        rows = [row for row in rows if row["status"] != "ok"]
+    write_audit(rows, output, fmt)
@@ -0,0 +1,111 @@
+import json
+import os
+import time
+
+import requests
+
+# netbox >= 4.1 serves the change log from core, older versions from extras
+CHANGELOG_ENDPOINTS = ["core/object-changes/", "extras/object-changes/"]
+
+
+class ChangeLog(object):
+    """Reads the netbox object change log to find out whether anything changed
+    since the last refresh of the cache"""
+
+    def __init__(self, base_uri, token, timeout=10.0, page_size=500):
+        self.base_uri = base_uri.rstrip("/") + "/"
+        self.timeout = timeout
+        self.page_size = page_size
+        self.endpoint = None
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"Authorization": "Token %s" % token, "Accept": "application/json"}
+        )
+
+    def _get(self, url, params=None):
+        rsp = self.session.get(url, params=params, timeout=self.timeout)
+        rsp.raise_for_status()
+        return rsp.json()
+
+    def _find_endpoint(self):
+        if self.endpoint is None:
+            for endpoint in CHANGELOG_ENDPOINTS:
+                try:
+                    self._get(self.base_uri + endpoint, {"limit": 1})
+                except requests.HTTPError as e:
+                    if e.response is not None and e.response.status_code == 404:
+                        continue
+                    raise
+                self.endpoint = endpoint
+                break
+            else:
+                raise RuntimeError("netbox has no object change log endpoint")
+        return self.base_uri + self.endpoint
+
+    def latest(self):
+        """Returns the newest change, None if the change log is empty"""
+        data = self._get(self._find_endpoint(), {"limit": 1, "ordering": "-id"})
+        results = data.get("results") or []
+        return results[0] if results else None
+
+    def changes_since(self, last_id, last_time=None):
+        """Returns all changes with an id above last_id, oldest first"""
+        params = {"limit": self.page_size, "ordering": "id", "id__gt": last_id}
+        if last_time:
+            params["time_after"] = last_time
+        url = self._find_endpoint()
+        changes = []
+        while url:
+            data = self._get(url, params)
+            changes.extend(c for c in data.get("results") or [] if c["id"] > last_id)
+            # the next url carries the query parameters
+            url, params = data.get("next"), None
+        return sorted(changes, key=lambda c: c["id"])
+
+
+class SyncState(object):
+    """Position in the change log at the last refresh of the cache, stored
+    next to the cache file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.last_id = None
+        self.last_time = None
+        self.last_full = 0
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            self.last_id = data.get("last_id")
+            self.last_time = data.get("last_time")
+            self.last_full = data.get("last_full", 0)
+        except (OSError, ValueError):
+            pass
+
+    def update(self, change, full=False):
+        if change is not None:
+            self.last_id = change["id"]
+            self.last_time = change.get("time")
+        if full:
+            self.last_full = time.time()
+
+    def save(self):
+        tmppath = self.path + ".tmp"
+        with open(tmppath, "w") as f:
+            json.dump(
+                {
+                    "last_id": self.last_id,
+                    "last_time": self.last_time,
+                    "last_full": self.last_full,
+                },
+                f,
+            )
+        os.rename(tmppath, self.path)
+
+
+def summarize_changes(changes):
+    """Returns a short "<count> <object type>" summary of a list of changes"""
+    counts = {}
+    for change in changes:
+        objtype = change.get("changed_object_type") or "unknown"
+        counts[objtype] = counts.get(objtype, 0) + 1
+    return ", ".join("%d %s" % (n, t) for t, n in sorted(counts.items()))
@@ -1,14 +1,26 @@
-from flask import Flask, g, current_app, Response, redirect
-from imfcfg.c3cfg import loadVars, loadKeys
+from flask import Flask, g, current_app, Response, redirect, request
+from imfcfg.c3cfg import loadVars
 import os
+import time
 import yaml
 import json
-from copy import deepcopy
+from collections import ChainMap
 from imfcfg.nbh import *
 from imfcfg.loader import *
 from imfcfg.routing import *
-from imfcfg.render import init_template, TemplateLoader
-from imfcfg.util import hash_password
+from imfcfg.render import (
+    init_template,
+    precompile_templates,
+    TemplateLoader,
+    RenderCache,
+    ConfigHistory,
+)
+from imfcfg.frontend.prerender import Prerenderer, prerender_devices
+from imfcfg.frontend.portstatus import PortStatusPoller, snmp_address
+from imfcfg.snmp.tablewalk import snmp_cached_client_from_config
+from imfcfg.frontend.metrics import FrontendMetrics
+from imfcfg.metrics import PhaseTimes
+from imfcfg.util import supports_patch
 
 try:
     import configparser
@@ -20,10 +32,87 @@ class NoSuchDeviceError(Exception):
     pass
 
 
-def get_nb():
-    if nb not in g:
-        g.nb = get_nb()
-    return db
+def render_device(app, device):
+    """Loads the template variables of device and renders its config"""
+    static = app.config.static
+    phases = PhaseTimes()
+    # device specific variables go into the first map, the static ones are
+    # shared read-only between all renders
+    tvars = ChainMap({}, static.get())
+    signature = static.signature
+    with phases.phase("get_source_type"):
+        typ, data, path, checkmodif = app.config.loader.get_source_type(
+            app.config.templateEnv, device
+        )
+    if typ == "router":
+        with phases.phase("loadRouterData"):
+            loadRouterData(tvars, device)
+
+            routers = get_nb().dev_by_role(ROLE_BORDER_ROUTER)
+            tvars.update(iBGP4=iBGP4(device, routers))
+            tvars.update(iBGP6=iBGP6(device, routers))
+    if typ == "switch":
+        with phases.phase("loadSwitchData"):
+            loadSwitchData(tvars, device)
+    with phases.phase("loadVlans"):
+        tvars.update(vlans=loadVlans())
+
+        tvars.update(prefixes=loadPrefixes())
+
+    with phases.phase("render"):
+        tpl = app.config.templateEnv.get_template(device)
+        dev_config = tpl.render(**tvars)
+    for phase, seconds in phases.times.items():
+        app.config.metrics.phase_seconds.observe(seconds, phase=phase)
+
+    def uptodate():
+        return checkmodif() and static.unchanged(signature)
+
+    return path, uptodate, dev_config
+
+
+def render_cached(app, device, generation):
+    """Returns the rendered config of device from the render cache, renders
+    and stores it if it is not cached for this generation"""
+    render_cache = app.config.render_cache
+    rendered = render_cache.get(device, generation)
+    if rendered is None:
+        with recording_inputs() as inputs:
+            path, checkmodif, dev_config = render_device(app, device)
+        app.config.fingerprints.record(device, generation, inputs)
+        rendered = render_cache.put(
+            device,
+            generation,
+            path,
+            os.path.getmtime(path),
+            dev_config.encode("UTF-8"),
+            checkmodif,
+        )
+        app.config.metrics.render_bytes.observe(len(rendered.body))
+    return rendered
+
+
+def device_supports_patch(device):
+    """Returns True if configs of device can be sent as patches, devices are
+    looked up by name or serial like templates are"""
+    found = get_nb().dev_by_name(device) or get_nb().dev_by_serial(device)
+    return len(found) == 1 and supports_patch(found[0])
+
+
+def select_changed(app, names, generation):
+    """Returns the devices of names whose netbox inputs changed since their
+    last render, the cached configs of all others move to generation"""
+    changed, unchanged = app.config.fingerprints.changed(get_nb(), generation, names)
+    for device, old_generation in unchanged.items():
+        if not app.config.render_cache.rebase(device, old_generation, generation):
+            changed.append(device)
+    app.config.changes = {
+        "generation": repr(generation),
+        "checked": time.time(),
+        "devices": len(names),
+        "changed": sorted(changed),
+    }
+    return changed
 
 
 def create_app(nb=None):
@@ -57,40 +146,59 @@ def create_app(nb=None):
         quick="semi",
     )
 
-    store_nb(nb)
+    netbox_trace = config.getboolean("frontend", "netbox_trace", fallback=False)
+    nb = store_nb(nb, dbtruepath, trace=netbox_trace)
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
     app.jinja_loader = lambda x: TemplateLoader(nb, x)
     app.config.nb = nb
+    app.config.netbox_trace = netbox_trace
+    cache_path = config.get("templates", "cache_path", fallback=None)
     app.config.loader, app.config.templateEnv = init_template(
-        nb, os.path.expanduser(config.get("templates", "path"))
+        nb,
+        os.path.expanduser(config.get("templates", "path")),
+        cache_path and os.path.expanduser(cache_path),
     )
+    register_prefix_globals(app.config.templateEnv)
+    # fills the shared bytecode cache, or loads the templates from it
+    precompile_templates(app.config.templateEnv, app.config.loader)
 
-    tvars = {}
-    db_path = config.get("db", "path")
-    with open(f"{db_path}/groups.yml", "r") as stream:
-        groups = yaml.safe_load(stream)
-        tvars.update(groups=groups)
-    with open(f"{db_path}/users.yml", "r") as stream:
-        users = yaml.safe_load(stream)
-        tvars.update(users=users)
-    with open(f"{db_path}/keys.yml", "r") as stream:
-        keys = yaml.safe_load(stream)
-        tvars.update(keys=keys)
-    with open(f"{db_path}/event-config.json", "r") as stream:
-        event_config = json.load(stream)
-        event_config["md5crypt_admin_password"] = hash_password(
-            event_config["admin_password"], "sha256"
-        )
-        event_config["md5crypt_admin_password"] = hash_password(
-            event_config["admin_password"], "md5"
+    app.config.static = static_data_from_config(config)
+    app.config.static.get()
+    app.config.render_cache = RenderCache(
+        config.getint("frontend", "render_cache_mb", fallback=64) * 1024 * 1024
+    )
+
+    app.config.metrics = FrontendMetrics(app.config.render_cache)
+
+    app.config.history = ConfigHistory(
+        config.getint("frontend", "config_history", fallback=8),
+        config.getint("frontend", "config_history_mb", fallback=64) * 1024 * 1024,
+    )
+    app.config.fingerprints = DeviceFingerprints()
+    app.config.changes = None
+    app.config.prerender = None
+    workers = config.getint("frontend", "prerender_workers", fallback=2)
+    if workers > 0:
+        app.config.prerender = Prerenderer(
+            lambda device, generation: render_cached(app, device, generation),
+            lambda: prerender_devices(nb),
+            nb_generation,
+            workers=workers,
+            interval=config.getfloat("frontend", "prerender_interval", fallback=10.0),
+            select=lambda names, generation: select_changed(app, names, generation),
         )
-        tvars.update(event_config=event_config)
-    with open(f"{db_path}/access-users.json", "r") as stream:
-        access_users = json.load(stream)
-        tvars.update(access_users=access_users)
+        app.config.prerender.start()
 
-    app.config.tvars = tvars
+    app.config.port_status = None
+    if config.has_option("snmp", "community"):
+        app.config.port_status = PortStatusPoller(
+            snmp_cached_client_from_config(config),
+            ttl=config.getfloat("frontend", "port_status_ttl", fallback=15.0),
+            keep=config.getfloat("frontend", "port_status_keep", fallback=300.0),
+            wait=config.getfloat("frontend", "port_status_wait", fallback=5.0),
+        )
+        app.config.port_status.start()
 
     # ensure the instance folder exists
     try:
@@ -98,36 +206,147 @@ def create_app(nb=None):
     except OSError:
         pass
 
+    @app.before_request
+    def request_started():
+        g.request_start = time.perf_counter()
+        app.config.metrics.in_flight.inc()
+
+    @app.teardown_request
+    def request_finished(exc):
+        start = g.pop("request_start", None)
+        if start is None:
+            return
+        app.config.metrics.in_flight.dec()
+        app.config.metrics.request_seconds.observe(
+            time.perf_counter() - start, endpoint=request.endpoint or "none"
+        )
+
     @app.route("/status")
     def status():
         return "It works"
 
+    @app.route("/metrics")
+    def metrics():
+        """metrics in the Prometheus text format"""
+        return Response(
+            app.config.metrics.exposition(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
     @app.route("/<device>")
     def render_hostname(device):
-        tvars = deepcopy(current_app.config.tvars)
         try:
-            typ, data, path, checkmodif = current_app.config.loader.get_source_type(
-                current_app.config.templateEnv, device
-            )
-            if typ == "router":
-                loadRouterData(tvars, device)
+            rendered = render_cached(current_app, device, nb_generation())
+        except NoSuchDeviceError as e:
+            return "Hostname not found", 404
+        app.config.history.add(rendered)
 
-                routers = nb.dev_by_role(ROLE_BORDER_ROUTER)
-                tvars.update(iBGP4=iBGP4(device, routers))
-                tvars.update(iBGP6=iBGP6(device, routers))
-            if typ == "switch":
-                loadSwitchData(tvars, device)
-            tvars.update(vlans=loadVlans())
+        rsp = Response(rendered.body, content_type="text/plain")
+        rsp.set_etag(rendered.etag)
+        # answers If-None-Match with a 304 if the config did not change
+        return rsp.make_conditional(request)
 
-            tvars.update(prefixes=loadPrefixes())
+    @app.route("/<device>/patch")
+    def render_patch(device):
+        """load replace patch from the config with the ETag given as base
+        argument or If-None-Match to the current one, the full config if
+        the base is unknown or the device is no Junos device"""
+        try:
+            rendered = render_cached(current_app, device, nb_generation())
         except NoSuchDeviceError as e:
             return "Hostname not found", 404
+        app.config.history.add(rendered)
 
-        tpl = current_app.config.templateEnv.get_template(device)
-        dev_config = tpl.render(**tvars)
-        rsp = Response(dev_config, content_type="text/plain")
+        base = request.args.get("base")
+        if base is None:
+            # "*" names no config to patch, it gets the full one
+            etags = request.if_none_match.as_set(include_weak=True)
+            if rendered.etag in etags:
+                base = rendered.etag
+            else:
+                # any of the client's configs a patch can be made from
+                for etag in sorted(etags):
+                    if app.config.history.get(device, etag) is not None:
+                        base = etag
+                        break
+        if base == rendered.etag:
+            rsp = Response(status=304)
+        else:
+            mode, body = app.config.history.delta(
+                device,
+                base,
+                rendered,
+                base is not None and device_supports_patch(device),
+            )
+            rsp = Response(body, content_type="text/plain")
+            rsp.headers["X-Config-Mode"] = mode
+            if mode == "patch":
+                rsp.headers["X-Config-Base"] = base
+        rsp.set_etag(rendered.etag)
         return rsp
 
+    @app.route("/<device>/trace")
+    def trace_render(device):
+        """renders device bypassing the render cache and reports the netbox
+        calls the render made, by method"""
+        if not app.config.netbox_trace:
+            return "Netbox tracing disabled", 404
+        try:
+            with tracing_calls() as calls:
+                render_device(current_app, device)
+        except NoSuchDeviceError as e:
+            return "Hostname not found", 404
+        return calls.to_dict()
+
+    @app.route("/prerender")
+    def prerender_status():
+        if app.config.prerender is None:
+            return "Prerendering disabled", 404
+        return app.config.prerender.snapshot()
+
+    @app.route("/changed")
+    def changed_devices():
+        """devices whose config changed with the last netbox cache refresh"""
+        if app.config.changes is None:
+            return "No cache refresh checked yet", 404
+        return app.config.changes
+
+    @app.route("/ports/<device>")
+    def port_status(device):
+        """live port status of one device"""
+        if app.config.port_status is None:
+            return "Port status disabled", 404
+        snmpip = snmp_address(nb, device)
+        if snmpip is None:
+            return "Hostname not found", 404
+        return app.config.port_status.get({device: snmpip})[device]
+
+    @app.route("/ports")
+    def port_status_devices():
+        """live port status of the comma separated devices"""
+        if app.config.port_status is None:
+            return "Port status disabled", 404
+        names = [
+            name
+            for arg in request.args.getlist("devices")
+            for name in arg.split(",")
+            if name
+        ]
+        if not names:
+            return "No devices given", 400
+        addresses = {}
+        unknown = []
+        for name in names:
+            snmpip = snmp_address(nb, name)
+            if snmpip is None:
+                unknown.append(name)
+            else:
+                addresses[name] = snmpip
+        result = app.config.port_status.get(addresses)
+        for name in unknown:
+            result[name] = {"ports": None, "age": None, "error": "Hostname not found"}
+        return result
+
     @app.route("/by_serial/<serial>")
     def render_serial(serial):
         device = nb.dev_by_serial(serial)
@@ -0,0 +1,49 @@
+from imfcfg.metrics import Registry, SIZE_BUCKETS
+
+
+class FrontendMetrics(Registry):
+    """Metrics of one frontend process, served at /metrics
+
+    Phase times and config sizes are observed for renders only, configs
+    served from the render cache count as cache hits.
+    """
+
+    def __init__(self, render_cache):
+        super(FrontendMetrics, self).__init__()
+        self.phase_seconds = self.histogram(
+            "imfcfg_render_phase_seconds",
+            "Time spent in each phase of rendering a config",
+            labels=("phase",),
+        )
+        self.render_bytes = self.histogram(
+            "imfcfg_render_bytes", "Size of rendered configs", buckets=SIZE_BUCKETS
+        )
+        self.request_seconds = self.histogram(
+            "imfcfg_request_seconds",
+            "Time to answer a request",
+            labels=("endpoint",),
+        )
+        self.in_flight = self.gauge(
+            "imfcfg_requests_in_flight", "Requests being answered"
+        )
+        self.counter(
+            "imfcfg_render_cache_hits_total",
+            "Configs served from the render cache",
+            func=lambda: render_cache.hits,
+        )
+        self.counter(
+            "imfcfg_render_cache_misses_total",
+            "Configs not in the render cache",
+            func=lambda: render_cache.misses,
+        )
+        self.gauge(
+            "imfcfg_render_cache_hit_ratio",
+            "Share of configs served from the render cache",
+            func=lambda: render_cache.hits
+            / float(render_cache.hits + render_cache.misses or 1),
+        )
+        self.gauge(
+            "imfcfg_render_cache_bytes",
+            "Size of the configs in the render cache",
+            func=lambda: render_cache.size,
+        )
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+import traceback
+
+from imfcfg.snmp.tablewalk import if_table_oper, ifx_table, interface_ports
+
+
+def snmp_address(nb, device):
+    """Returns the address device is polled at, None for unknown devices"""
+    dev = nb.dev_by_name(device)
+    if len(dev) != 1:
+        return None
+    ip4 = (dev[0].get("primary_ip4") or {}).get("address")
+    return ip4.split("/")[0] if ip4 else None
+
+
+class PortStatusPoller(object):
+    """Keeps the port status of recently requested devices fresh
+
+    Requests are answered from memory. A background thread walks the
+    ifXTable and ifOperStatus of every device requested in the last keep
+    seconds once its status is older than ttl, all due devices at once with
+    one SnmpClient. Devices seen for the first time are waited for up to
+    wait seconds. A failed walk keeps the last good ports and sets error.
+    With a CachedSnmpClient, tables other processes walked recently are
+    taken from the cache.
+    """
+
+    def __init__(self, client, ttl=15.0, keep=300.0, wait=5.0):
+        self.client = client
+        self.ttl = ttl
+        self.keep = keep
+        self.wait = wait
+        # device -> {"checked", "updated", "ports", "error"}
+        self._status = {}
+        # device -> (snmp address, last requested)
+        self._wanted = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._loop = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._watch, name="portstatus", daemon=True
+        )
+        self._thread.start()
+
+    def _due(self, now):
+        due = {}
+        for device, (snmpip, requested) in list(self._wanted.items()):
+            if now - requested > self.keep:
+                del self._wanted[device]
+                self._status.pop(device, None)
+                continue
+            status = self._status.get(device)
+            if status is None or now - status["checked"] >= self.ttl:
+                due[device] = snmpip
+        return due
+
+    def _watch(self):
+        self._loop = asyncio.new_event_loop()
+        while True:
+            with self._cond:
+                due = self._due(time.time())
+                if not due:
+                    # woken up early by requests for new devices
+                    self._cond.wait(min(self.ttl, 1.0))
+                    continue
+            try:
+                polled = self.poll(due)
+            except Exception as e:
+                traceback.print_exc()
+                polled = dict((device, e) for device in due)
+            now = time.time()
+            with self._cond:
+                for device, ports in polled.items():
+                    status = dict(
+                        self._status.get(device)
+                        or {"updated": None, "ports": None, "error": None}
+                    )
+                    status["checked"] = now
+                    if isinstance(ports, Exception):
+                        status["error"] = "%s: %s" % (type(ports).__name__, ports)
+                    else:
+                        status.update(updated=now, ports=ports, error=None)
+                    self._status[device] = status
+                self._cond.notify_all()
+
+    def poll(self, devices):
+        """Walks {device: snmp address}, returns device -> ports, or the
+        exception of the failed walk"""
+        names = sorted(devices)
+        tables = self._loop.run_until_complete(
+            self.client.get_tables(
+                [(devices[name], ifx_table, 1) for name in names]
+                + [(devices[name], if_table_oper, 0) for name in names]
+            )
+        )
+        polled = {}
+        for i, name in enumerate(names):
+            if_table, oper_table = tables[i], tables[len(names) + i]
+            for table in (if_table, oper_table):
+                if isinstance(table, Exception):
+                    polled[name] = table
+                    break
+            else:
+                try:
+                    polled[name] = interface_ports(if_table, oper_table)
+                except Exception as e:
+                    polled[name] = e
+        return polled
+
+    def get(self, devices):
+        """Returns device -> status for {device: snmp address}"""
+        now = time.time()
+        deadline = now + self.wait
+        with self._cond:
+            for device, snmpip in devices.items():
+                self._wanted[device] = (snmpip, now)
+            if any(device not in self._status for device in devices):
+                self._cond.notify_all()
+            while any(device not in self._status for device in devices):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            now = time.time()
+            return dict((device, self._response(device, now)) for device in devices)
+
+    def _response(self, device, now):
+        status = self._status.get(device)
+        if status is None:
+            return {"ports": None, "age": None, "error": "not polled yet"}
+        updated = status["updated"]
+        return {
+            "ports": status["ports"],
+            "age": round(now - updated, 1) if updated is not None else None,
+            "error": status["error"],
+        }
@@ -0,0 +1,117 @@
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+PRERENDER_ROLES = ["access-switch", "router"]
+
+
+class Prerenderer(object):
+    """Renders all routers and access switches whenever a new netbox cache
+    generation shows up, so the first poll after a refresh is a cache hit.
+
+    render(device, generation) renders and stores the config of one device,
+    devices() returns the device names to render and generation() the
+    current netbox cache generation. If select(names, generation) is given it
+    returns the subset of names that needs rendering after a cache refresh.
+    """
+
+    def __init__(
+        self, render, devices, generation, workers=2, interval=10.0, select=None
+    ):
+        self.render = render
+        self.devices = devices
+        self.generation = generation
+        self.select = select
+        self.workers = workers
+        self.interval = interval
+        self.last_generation = None
+        self.status = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._watch, name="prerender", daemon=True
+        )
+        self._thread.start()
+
+    def _watch(self):
+        while True:
+            generation = self.generation()
+            if generation != self.last_generation:
+                try:
+                    self.run(generation)
+                except Exception:
+                    traceback.print_exc()
+            time.sleep(self.interval)
+
+    def run(self, generation):
+        names = self.devices()
+        total = len(names)
+        if self.select is not None:
+            names = self.select(names, generation)
+        timings = {}
+        failures = {}
+        status = {
+            "generation": repr(generation),
+            "started": time.time(),
+            "finished": None,
+            "devices": total,
+            "skipped": total - len(names),
+            "rendered": 0,
+            "failed": failures,
+            "timings": timings,
+        }
+        self.status = status
+
+        def render_one(name):
+            start = time.time()
+            error = None
+            try:
+                self.render(name, generation)
+            except Exception as e:
+                error = repr(e)
+            with self._lock:
+                if error is None:
+                    status["rendered"] += 1
+                else:
+                    failures[name] = error
+                timings[name] = round(time.time() - start, 4)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(render_one, names))
+
+        with self._lock:
+            status["finished"] = time.time()
+        self.last_generation = generation
+        sys.stderr.write(
+            "prerender: %d devices rendered, %d failed, %d unchanged in %.1fs\n"
+            % (
+                status["rendered"],
+                len(failures),
+                status["skipped"],
+                status["finished"] - status["started"],
+            )
+        )
+        for name, error in sorted(failures.items()):
+            sys.stderr.write("prerender: %s failed: %s\n" % (name, error))
+        return status
+
+    def snapshot(self):
+        """Returns a copy of the status of the current or last run"""
+        with self._lock:
+            status = dict(self.status)
+            for key in ["failed", "timings"]:
+                if key in status:
+                    status[key] = dict(status[key])
+        return status
+
+
+def prerender_devices(nb):
+    return [
+        device["name"]
+        for device in nb.devices()
+        if device["device_role"]["slug"] in PRERENDER_ROLES
+    ]
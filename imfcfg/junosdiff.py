@@ -0,0 +1,159 @@
+import re
+from collections import OrderedDict, namedtuple
+
+from imfcfg.junosparse import parse
+
+# a change at path, the headers of the blocks down to it: op is "replace"
+# with the new statement text or "delete" with the statement to delete
+Change = namedtuple("Change", "op path text")
+
+# blocks of these statements are evaluated in order, so new ones can only
+# be added after the existing ones
+ORDERED_STATEMENTS = ("term",)
+
+_LEAF_RE = re.compile(r'[^;"]*(?:"(?:[^\\"]|\\.)*"[^;"]*)*;')
+_NORMALIZE_RE = re.compile(r'("(?:[^\\"]|\\.)*")|#[^\n]*|/\*.*?\*/|(\s+)', re.S)
+
+
+def _normalize(text):
+    """Returns a statement without comments and with single spaces"""
+    if '"' not in text and "#" not in text and "/*" not in text:
+        return " ".join(text.split())
+    return _NORMALIZE_RE.sub(
+        lambda m: m.group(1) or (" " if m.group(2) else ""), text
+    ).strip()
+
+
+class Stanza(object):
+    """One block of a config: its header, the sorted leaf statements and the
+    child blocks by header, split up on first use"""
+
+    def __init__(self, header, blob):
+        self.header = header
+        self.blob = blob
+        self._leaves = None
+        self._children = None
+
+    def _split(self):
+        view = self.blob.view
+        offset = self.blob.span[0]
+        leaves = []
+        self._children = OrderedDict()
+        pos = 0
+        for child in self.blob.blocks:
+            start, end = child.span
+            # the text between the previous block and this one's "{"
+            gap = str(view[pos : start - 1 - offset], "utf-8")
+            m = None
+            for m in _LEAF_RE.finditer(gap):
+                leaves.append(_normalize(m.group(0)))
+            header = _normalize(gap[m.end() if m else 0 :])
+            # later duplicates are merged into the first by junos
+            self._children[header] = Stanza(header, child)
+            pos = end + 1 - offset
+        for m in _LEAF_RE.finditer(str(view[pos:], "utf-8")):
+            leaves.append(_normalize(m.group(0)))
+        self._leaves = sorted(leaf for leaf in leaves if leaf != ";")
+
+    @property
+    def leaves(self):
+        if self._leaves is None:
+            self._split()
+        return self._leaves
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._split()
+        return self._children
+
+    def text(self):
+        return "%s {%s}" % (self.header, self.blob.value)
+
+
+def _ordered(header):
+    return header.split(" ", 1)[0] in ORDERED_STATEMENTS
+
+
+def _order_changed(old, new):
+    old_seq = [h for h in old.children if _ordered(h) and h in new.children]
+    new_seq = [h for h in new.children if _ordered(h)]
+    kept = [h for h in new_seq if h in old.children]
+    # existing blocks keep their order and new ones come after all of them
+    return old_seq != kept or new_seq[: len(kept)] != kept
+
+
+def _diff(old, new, path, changes):
+    for header in old.children:
+        if header not in new.children:
+            changes.append(Change("delete", path, header + ";"))
+    for header, child in new.children.items():
+        old_child = old.children.get(header)
+        if old_child is None:
+            changes.append(Change("replace", path, child.text()))
+        elif child.leaves != old_child.leaves or _order_changed(old_child, child):
+            changes.append(Change("replace", path, child.text()))
+        elif child.blob.view != old_child.blob.view:
+            # blocks with the same text are not split up at all
+            _diff(old_child, child, path + (header,), changes)
+
+
+def diff(old, new):
+    """Returns the changes turning the config tree old into new
+
+    Blocks whose leaf statements changed are replaced as a whole, blocks
+    that only differ in their child blocks are descended into, so only the
+    smallest changed blocks end up in the patch.
+    """
+    old, new = Stanza("", old), Stanza("", new)
+    changes = []
+    # top level leaves have no block to be replaced with
+    old_leaves, new_leaves = set(old.leaves), set(new.leaves)
+    for leaf in old.leaves:
+        if leaf not in new_leaves:
+            changes.append(Change("delete", (), leaf))
+    for leaf in new.leaves:
+        if leaf not in old_leaves:
+            changes.append(Change("replace", (), leaf))
+    _diff(old, new, (), changes)
+    return changes
+
+
+def format_patch(changes):
+    """Returns changes as config text for "load replace", with replace: and
+    delete: tags"""
+    lines = []
+    current = ()
+    for change in changes:
+        common = 0
+        while (
+            common < min(len(current), len(change.path))
+            and current[common] == change.path[common]
+        ):
+            common += 1
+        for depth in range(len(current) - 1, common - 1, -1):
+            lines.append("    " * depth + "}")
+        for depth in range(common, len(change.path)):
+            lines.append("    " * depth + change.path[depth] + " {")
+        current = change.path
+        indent = "    " * len(current)
+        lines.append(indent + change.op + ":")
+        lines.append(indent + change.text)
+    for depth in range(len(current) - 1, -1, -1):
+        lines.append("    " * depth + "}")
+    return "".join(line + "\n" for line in lines)
+
+
+def _is_junos(tree):
+    """Returns True if the top level of tree has Junos blocks or statements,
+    configs without braces and semicolons parse to nothing"""
+    return bool(tree.blocks) or bool(Stanza("", tree).leaves)
+
+
+def config_patch(old, new):
+    """Returns the load replace patch between two config texts. Raises
+    ValueError if either one is no Junos config."""
+    old, new = parse(old), parse(new)
+    if not (_is_junos(old) and _is_junos(new)):
+        raise ValueError("not a Junos config")
+    return format_patch(diff(old, new))
@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 
 import sys, os, subprocess, re, struct
-import ply.lex as lex, ply.yacc as yacc
 
 
 class JunosLexer(object):
@@ -105,6 +104,8 @@ class JunosLexer(object):
 
     # general foo
     def build(self, **kwargs):
+        import ply.lex as lex
+
         self.lexer = lex.lex(module=self, optimize=1, lextab="ply_lex", **kwargs)
         return self
 
@@ -118,9 +119,50 @@ class JunosLexer(object):
 
 
 class Blob(dict):
-    def __init__(self, value=""):
+    """A block of a config, value is the text between its braces
+
+    Blobs hold no text of their own but (start, end) byte offsets into the
+    UTF-8 source buffer shared by the whole tree, value is decoded from it
+    on every access. Assigning value gives the Blob a buffer of its own.
+    """
+
+    __slots__ = ("_source", "_start", "_end", "blocks")
+
+    def __init__(self, value="", source=None, start=0, end=None):
         super(Blob, self).__init__()
-        self.value = value
+        if source is None:
+            self.value = value
+        else:
+            self._source = source
+            self._start = start
+            self._end = len(source) if end is None else end
+        # every child block in text order, duplicates included
+        self.blocks = ()
+
+    @property
+    def value(self):
+        return str(self.view, "utf-8")
+
+    @value.setter
+    def value(self, text):
+        self._source = memoryview(text.encode("utf-8"))
+        self._start = 0
+        self._end = len(self._source)
+
+    @property
+    def view(self):
+        """memoryview of the UTF-8 encoded value, without copying it"""
+        return self._source[self._start : self._end]
+
+    @property
+    def size(self):
+        """length of the UTF-8 encoded value in bytes"""
+        return self._end - self._start
+
+    @property
+    def span(self):
+        """(start, end) of value in the source buffer"""
+        return self._start, self._end
 
 
 class JunosParser(object):
@@ -143,30 +185,146 @@ class JunosParser(object):
         p[0][p[1]] = p[4]
 
     def build(self, **kwargs):
+        import ply.yacc as yacc
+
         self.parser = yacc.yacc(
             module=self, start="data", tabmodule="ply_yacc", **kwargs
         )
         return self
 
 
-lexer = JunosLexer().build()
-parser = JunosParser().build()
+# ply lexer and parser, built on first use
+_ply = None
 
 
-def parse(data):
+def ply_parser():
+    """Returns the (lexer, parser) pair of the ply grammar"""
+    global _ply
+    if _ply is None:
+        _ply = (JunosLexer().build(), JunosParser().build())
+    return _ply
+
+
+def ply_parse(data):
+    """Parses data with the ply grammar, its runtime is quadratic in the
+    size of data"""
+    lexer, parser = ply_parser()
     lexer.lexer.lineno = 1
     return parser.parser.parse(data, lexer=lexer.lexer)
 
 
+# the characters the parser has to look at, everything else is part of
+# WORD or SPACE tokens
+_SPECIAL_RE = re.compile(rb'[{}"/]')
+_STRING_RE = re.compile(rb'"(?:[^\\"]|\\.)*"')
+
+# the ASCII characters str.isspace() is true for, other whitespace only
+# exists in UTF-8 as multi byte sequences and is part of words here
+_SPACE = frozenset(b" \t\n\r\f\v\x1c\x1d\x1e\x1f")
+_NOT_WORD = _SPACE | frozenset(b'{}"/')
+_QUOTE, _SLASH, _OPEN = b'"/{'
+
+
+def _error(data, pos, msg):
+    line_start = data.rfind(b"\n", 0, pos) + 1
+    line = data[line_start:].split(b"\n", 1)[0].decode("utf-8", "replace")
+    relpos = len(data[line_start:pos].decode("utf-8", "replace"))
+    indent = "".join([" " if i != "\t" else "\t" for i in line[:relpos]])
+    return ValueError(
+        "<input>:%d:%d: %s\n> %s\n> %s^- here"
+        % (data.count(b"\n", 0, pos) + 1, relpos + 1, msg, line, indent)
+    )
+
+
+def _block(source, start, end, children):
+    blob = Blob(source=source, start=start, end=end)
+    # the ply grammar is right recursive and adds the last block first, so
+    # keys are in reverse order and the first of duplicate blocks wins
+    for key, child in reversed(children):
+        blob[key] = child
+    if children:
+        blob.blocks = tuple(child for key, child in children)
+    return blob
+
+
+def parse(data):
+    """Parses a Junos config into a tree of Blobs
+
+    Every block "WORD {...}" becomes a child Blob keyed by the WORD right
+    before the "{", holding the text between the braces as value. Slashes
+    are words of their own, so the key of "ge-0/0/1 {" is "1". Gives the
+    same tree as ply_parse in linear time by only looking at braces,
+    quotes and slashes. The blocks of every Blob also are in its blocks
+    list, in text order.
+
+    data is a str or UTF-8 encoded bytes, offsets of the Blobs are byte
+    offsets into the encoded data.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    source = memoryview(data)
+    # (key, start of block content, children) of the open blocks
+    stack = []
+    children = []
+    string_end = -1
+    string_start = -1
+    pos = 0
+    while True:
+        m = _SPECIAL_RE.search(data, pos)
+        if m is None:
+            break
+        pos = m.start()
+        c = data[pos]
+        if c == _QUOTE:
+            m = _STRING_RE.match(data, pos)
+            if m is None:
+                raise _error(data, pos, "Unterminated string")
+            string_start, string_end = pos, m.end()
+            pos = string_end
+        elif c == _SLASH:
+            if pos + 1 >= len(data) or data[pos + 1] == _SLASH:
+                raise _error(data, pos, "Illegal character '/'")
+            pos += 1
+        elif c == _OPEN:
+            # only valid as WORD SPACE '{'
+            end = pos
+            while end > 0 and data[end - 1] in _SPACE:
+                end -= 1
+            if end == pos or end == 0 or data[end - 1] in b"{}":
+                raise _error(data, pos, "Syntax error at '{'")
+            if data[end - 1] == _QUOTE:
+                start = string_start
+            elif data[end - 1] == _SLASH:
+                start = end - 1
+            else:
+                start = end - 1
+                while start > 0 and data[start - 1] not in _NOT_WORD:
+                    start -= 1
+            # keys repeat a lot in big configs ("unit", "0", "family")
+            key = sys.intern(data[start:end].decode("utf-8"))
+            stack.append((key, pos + 1, children))
+            children = []
+            pos += 1
+        else:
+            if not stack:
+                raise _error(data, pos, "Syntax error at '}'")
+            key, start, parent = stack.pop()
+            parent.append((key, _block(source, start, pos, children)))
+            children = parent
+            pos += 1
+    if stack:
+        raise _error(data, len(data), "Unexpected end of input, missing '}'")
+    return _block(source, 0, len(data), children)
+
+
 if __name__ == "__main__":
     tdata = open(sys.argv[1], "r").read()
-    lexer.test(tdata)
     data = parse(tdata)
 
     def recur(data, indent):
         for k, v in data.items():
-            print('%s"%s": %d bytes' % ("  " * indent, k, len(v.value)))
+            print('%s"%s": %d bytes' % ("  " * indent, k, v.size))
             recur(v, indent + 1)
 
-    print("root: %d bytes" % (len(data.value)))
+    print("root: %d bytes" % (data.size,))
     recur(data, 1)
@@ -1 +1,3 @@
 from .main import *
+from .fingerprint import *
+from .static import *
@@ -0,0 +1,83 @@
+import threading
+
+from nbh import call_digest
+
+
+class DeviceFingerprints(object):
+    """Remembers the netbox inputs of the last render of every device
+
+    After a netbox cache refresh the recorded calls are replayed against the
+    new cache, a device whose calls all return the same data as before would
+    render to the same config and does not need to be rendered again.
+    """
+
+    def __init__(self):
+        # device -> (generation, InputSet)
+        self._inputs = {}
+        self._lock = threading.Lock()
+
+    def record(self, device, generation, inputs):
+        with self._lock:
+            self._inputs[device] = (generation, inputs)
+
+    def forget(self, device=None):
+        with self._lock:
+            if device is None:
+                self._inputs.clear()
+            else:
+                self._inputs.pop(device, None)
+
+    def get(self, device):
+        """Returns (generation, InputSet) of the last render of device"""
+        with self._lock:
+            return self._inputs.get(device)
+
+    def fingerprint(self, device):
+        entry = self.get(device)
+        return entry[1].fingerprint() if entry else None
+
+    def changed(self, netbox, generation, devices):
+        """Returns (changed, unchanged) for devices against the netbox cache of
+        generation.
+
+        changed lists the devices whose inputs changed or were never
+        recorded, unchanged maps every other device to the generation it was
+        rendered from. Unchanged devices are moved to the new generation.
+        """
+        changed = []
+        unchanged = {}
+        # call key -> digest in the new generation, shared by all devices
+        digests = {}
+        for device in devices:
+            entry = self.get(device)
+            if entry is None:
+                changed.append(device)
+                continue
+            old_generation, inputs = entry
+            if old_generation != generation and not self._same(
+                netbox, generation, inputs, digests
+            ):
+                changed.append(device)
+                continue
+            unchanged[device] = old_generation
+            with self._lock:
+                if self._inputs.get(device) is entry:
+                    self._inputs[device] = (generation, inputs)
+        return changed, unchanged
+
+    def _same(self, netbox, generation, inputs, digests):
+        for key, (method, args, digest) in inputs.calls.items():
+            current = digests.get(key)
+            if current is None:
+                try:
+                    result = getattr(netbox, method)(*args)
+                except Exception:
+                    return False
+                key, (current, _) = call_digest(generation, method, args, result)
+                digests[key] = current
+            if current != digest:
+                return False
+        return True
+
+    def __len__(self):
+        return len(self._inputs)
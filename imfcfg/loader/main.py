@@ -14,68 +14,66 @@ VLAN_IFACE_RE = re.compile(r"([Vv]lan|irb\.)([0-9]+)")
 TRANSIT_SUBIF_RE = re.compile(r"(.*)\.(\d+)")
 
 
-def loadVlans():
-    nb = get_nb()
+# vlans and prefix map, shared by all renders of a netbox cache generation
+vlan_prefix_memo = GenerationMemo("vlans_prefixes")
 
-    prefixes = {}
-    prefixnew = {}
 
-    nbprefixes = nb.prefixes()
-
-    for p in nbprefixes:
-        if p["status"]["value"] == "active" and p["vlan"]:
-            vid = int(p["vlan"]["vid"])
+def loadVlans():
+    """Returns the VlanDict of the current netbox cache generation, shared
+    between renders, don't modify"""
+    return vlan_prefix_memo.lookup(nb_generation(), None, _build_vlans_prefixes)[0]
 
-            firewall = p["custom_fields"].get("firewall", None)
-            if isinstance(firewall, dict):
-                firewall = firewall["label"]
 
-            prefixnew.setdefault(vid, []).append(
-                {
-                    "prefix": ipaddr.ip_network(p["prefix"]),
-                    "name": p["vlan"]["name"],
-                    "firewall": firewall or "public",
-                    "dhcp": p["custom_fields"].get("dhcp", True),
-                }
-            )
-    return VlanDict(nb, prefixnew)
+def loadPrefixes():
+    """Returns vid -> v4/v6 prefixes of the current netbox cache generation,
+    read-only"""
+    return vlan_prefix_memo.lookup(nb_generation(), None, _build_vlans_prefixes)[1]
 
 
-def loadPrefixes():
+def _build_vlans_prefixes():
     nb = get_nb()
+
+    # vid -> all prefixes of the vlan, for the VlanDict
+    prefixnew = {}
+    # vid -> v4 and v6 prefix
     prefixes = {}
-    nbprefixes = nb.prefixes()
-    for p in nbprefixes:
-        if p["status"]["value"] == "active":
-            if p["vlan"]:
-                # TODO check if we need to use .value like with ip-address
-                if p["family"]["value"] == 4:
-                    vid = p["vlan"]["vid"]
-                    fw = "public"
-                    if p["custom_fields"].get("firewall", None):
-                        fw = p["custom_fields"]["firewall"]
-                    dhcp = True
-                    if p["custom_fields"].get("dhcp", None) is not None:
-                        dhcp = p["custom_fields"]["dhcp"]
-                    if ipaddr.ip_network(p["prefix"]).prefixlen < 30:
-                        prefixes[vid] = {
-                            "v4": p["prefix"],
-                            "v6": site.pfx6 % vid,
-                            "name": p["vlan"]["name"],
-                            "fw": fw,
-                            "dhcp": dhcp,
-                        }
-                    else:
-                        prefixes[vid] = {
-                            "v4": p["prefix"],
-                            "v6": site.pfx6 % vid,
-                            "name": p["vlan"]["name"],
-                            "fw": fw,
-                            "dhcp": dhcp,
-                        }
-                elif p["family"] == 6:
-                    pass
-    return prefixes
+
+    for p in nb.prefixes():
+        if p["status"]["value"] != "active" or not p["vlan"]:
+            continue
+        vid = int(p["vlan"]["vid"])
+        custom_fields = p["custom_fields"]
+
+        firewall = custom_fields.get("firewall", None)
+        if isinstance(firewall, dict):
+            firewall = firewall["label"]
+
+        prefixnew.setdefault(vid, []).append(
+            {
+                "prefix": ipaddr.ip_network(p["prefix"]),
+                "name": p["vlan"]["name"],
+                "firewall": firewall or "public",
+                "dhcp": custom_fields.get("dhcp", True),
+            }
+        )
+
+        # TODO check if we need to use .value like with ip-address
+        if p["family"]["value"] == 4:
+            vid = p["vlan"]["vid"]
+            fw = "public"
+            if custom_fields.get("firewall", None):
+                fw = custom_fields["firewall"]
+            dhcp = True
+            if custom_fields.get("dhcp", None) is not None:
+                dhcp = custom_fields["dhcp"]
+            prefixes[vid] = {
+                "v4": p["prefix"],
+                "v6": site.pfx6 % vid,
+                "name": p["vlan"]["name"],
+                "fw": fw,
+                "dhcp": dhcp,
+            }
+    return VlanDict(nb, prefixnew), freeze(prefixes)
 
 
 def loadDeviceData(tvars, device):
@@ -84,6 +82,8 @@ def loadDeviceData(tvars, device):
     if len(dev) != 1:
         raise NoSuchDeviceError(device)
 
+    # copy, the record is what the input recording saw
+    dev = [dict(dev[0])]
     dev[0]["tags"] = get_tags(dev[0])
     ip4 = (dev[0].get("primary_ip4") or {}).get("address")
     ip6 = (dev[0].get("primary_ip6") or {}).get("address")
@@ -146,6 +146,8 @@ def loadRouterData(tvars, router):
     lags_circuit = {}
 
     vlans_all = set([vlan["vid"] for vlan in nb.vlans()])
+    # shared by all ports, the topology below each remote is walked once
+    downstream = DownstreamVlans(get_topology(), vlans_all, router)
 
     for iface in nb.int_by_device_name(router):
         remote = iface_get_remote_name(iface)
@@ -239,9 +241,7 @@ def loadRouterData(tvars, router):
                 router, remote.get("name"), iface, ip4, ip6
             )
         else:
-            untagged, vlans, vlans_root, remote = get_vlans_on_iface(
-                vlans_all, router, iface
-            )
+            untagged, vlans, vlans_root, remote = downstream.vlans_on_iface(iface)
             active_vlans.update(vlans)
             if remote_role == ROLE_DISTRIBUTION_SWITCH:
                 tlist, ifobj = distifs, DistIface(
@@ -0,0 +1,142 @@
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+
+import yaml
+
+from util import hash_password, freeze
+
+# template variable -> file in the db directory
+STATIC_FILES = [
+    ("groups", "groups.yml"),
+    ("users", "users.yml"),
+    ("keys", "keys.yml"),
+    ("event_config", "event-config.json"),
+    ("access_users", "access-users.json"),
+]
+
+STATIC_CACHE_VERSION = 1
+DEFAULT_STATIC_CACHE = "~/.cache/imfcfg/static-data.pickle"
+
+
+class StaticData(object):
+    """Static template variables (users, keys, event config, ...) from the db
+    directory
+
+    The files are parsed once and only reloaded when one of them changes.
+    The parsed data is also stored in cache_path, so a fresh process whose
+    files did not change since then skips parsing and password hashing.
+    """
+
+    def __init__(self, db_path, cache_path=None, check_interval=1.0):
+        self.db_path = db_path
+        self.cache_path = cache_path
+        self.check_interval = check_interval
+        self.signature = None
+        self.loads = 0
+        self._data = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def _signature(self):
+        sig = []
+        for name, filename in STATIC_FILES:
+            st = os.stat(os.path.join(self.db_path, filename))
+            sig.append((filename, st.st_ino, st.st_size, st.st_mtime_ns))
+        return (STATIC_CACHE_VERSION, os.path.abspath(self.db_path), tuple(sig))
+
+    def _parse(self):
+        data = {}
+        for name, filename in STATIC_FILES:
+            with open(os.path.join(self.db_path, filename), "r") as stream:
+                if filename.endswith(".json"):
+                    data[name] = json.load(stream)
+                else:
+                    data[name] = yaml.safe_load(stream)
+        event_config = data["event_config"]
+        event_config["md5crypt_admin_password"] = hash_password(
+            event_config["admin_password"], "md5"
+        )
+        event_config["crypted_admin_password"] = hash_password(
+            event_config["admin_password"], "sha256"
+        )
+        return data
+
+    def _load_cache(self, signature):
+        if self.cache_path is None:
+            return None
+        try:
+            with open(self.cache_path, "rb") as f:
+                cached_signature, data = pickle.load(f)
+        except Exception:
+            return None
+        if cached_signature != signature:
+            return None
+        return data
+
+    def _store_cache(self, signature, data):
+        if self.cache_path is None:
+            return
+        tmppath = "%s.%d.tmp" % (self.cache_path, os.getpid())
+        try:
+            # the data contains the admin password and its crypts, readable by
+            # the owner only
+            os.makedirs(os.path.dirname(self.cache_path) or ".", 0o700, exist_ok=True)
+            fd = os.open(tmppath, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                # a stale file of the same name keeps its mode
+                os.fchmod(fd, 0o600)
+                pickle.dump((signature, data), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, self.cache_path)
+        except OSError as e:
+            sys.stderr.write(
+                "could not write static data cache %s: %s\n" % (self.cache_path, e)
+            )
+
+    def get(self):
+        """Returns the static template variables as a read-only dict"""
+        now = time.time()
+        if self._data is not None and now - self._checked < self.check_interval:
+            return self._data
+        with self._lock:
+            signature = self._signature()
+            self._checked = now
+            if signature != self.signature:
+                data = self._load_cache(signature)
+                if data is None:
+                    data = self._parse()
+                    self._store_cache(signature, data)
+                self._data = freeze(data)
+                self.signature = signature
+                self.loads += 1
+        return self._data
+
+    def unchanged(self, signature):
+        """Returns True if the files are still the ones of signature"""
+        self.get()
+        return self.signature == signature
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_static_data(db_path, cache_path=None):
+    """Returns the StaticData store of db_path, shared within the process"""
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = _stores[db_path] = StaticData(db_path, cache_path)
+    return store
+
+
+def static_data_from_config(config):
+    """Returns the StaticData store for the [db] section of the netboxrc"""
+    cache_path = config.get("db", "cache_path", fallback=DEFAULT_STATIC_CACHE)
+    return get_static_data(
+        os.path.expanduser(config.get("db", "path")),
+        cache_path and os.path.expanduser(cache_path),
+    )
@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# seconds, from a cached lookup to a render of a large router
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# bytes, 1KB to 16MB
+SIZE_BUCKETS = tuple(1024 * 4**i for i in range(8))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"'
+        % (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """A metric in the Prometheus text format, optionally with labels
+
+    The value of metrics with a func is read from it on every exposition.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=(), func=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.func = func
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(
+                "%s has labels %r, not %r" % (self.name, self.labels, tuple(labels))
+            )
+        return tuple((name, labels[name]) for name in self.labels)
+
+    def samples(self):
+        """Yields (name, labels, value) of all samples"""
+        if self.func is not None:
+            yield self.name, (), self.func()
+            return
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            yield self.name, key, value
+
+    def exposition(self):
+        lines = ["# HELP %s %s" % (self.name, self.help)]
+        lines.append("# TYPE %s %s" % (self.name, self.type))
+        for name, labels, value in self.samples():
+            lines.append(
+                "%s%s %s" % (name, _format_labels(labels), _format_value(value))
+            )
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # a count per bucket, the sum last
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in sorted(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield self.name + "_bucket", key + (
+                    ("le", _format_value(bound)),
+                ), cumulative
+            yield self.name + "_sum", key, counts[-1]
+            yield self.name + "_count", key, cumulative
+
+
+class Registry(object):
+    """The metrics exposed by one process"""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError("metric %s already registered" % (metric.name,))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def exposition(self):
+        """Returns all metrics in the Prometheus text format"""
+        return "".join(metric.exposition() for metric in self._metrics.values())
+
+
+class PhaseTimes(object):
+    """Wall clock time spent in the phases of one render, in the order the
+    phases were first entered"""
+
+    def __init__(self):
+        self.times = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+    def add(self, other):
+        """Adds the times of the PhaseTimes or {phase: seconds} other"""
+        for name, seconds in getattr(other, "times", other).items():
+            self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def total(self):
+        return sum(self.times.values())
+
+    def format(self):
+        """Returns the phases as one line with the share of each"""
+        total = self.total() or 1.0
+        return ", ".join(
+            "%s %.1fms (%d%%)" % (name, seconds * 1000, round(100 * seconds / total))
+            for name, seconds in self.times.items()
+        )
@@ -1 +1,6 @@
 from .helper import *
+from .topology import *
+from .memo import *
+from .inputs import *
+from .trace import *
+from .prefixindex import *
@@ -2,8 +2,13 @@ from vlans import *
 from interfaces import *
 from util import *
 from cachedpynetbox import pynetbox
+from .topology import TopologyGraph
+from .memo import upstream_core_memo, default_vlan_memo
+from .inputs import ObservedNetbox
+from .trace import TracingNetbox
 
-from collections import namedtuple
+import os
+from collections import deque, namedtuple
 
 FakeDevice = namedtuple("FakeDevice", ["name", "role"])
 
@@ -21,50 +26,87 @@ VLAN_IFACE_RE = re.compile(r"([Vv]lan|irb\.)([0-9]+)")
 TRANSIT_SUBIF_RE = re.compile(r"(.*)\.(\d+)")
 
 nb = None
+nb_dbpath = None
+_observed = None
+_topology = None
 
 
-def store_nb(n_nb):
-    global nb
+def store_nb(n_nb, dbpath=None, trace=False):
+    """Stores the netbox handle, with trace wrapped in a TracingNetbox.
+    Returns the stored handle"""
+    global nb, nb_dbpath, _observed
+    if trace and n_nb is not None:
+        n_nb = TracingNetbox(n_nb)
     nb = n_nb
+    nb_dbpath = dbpath
+    _observed = ObservedNetbox(n_nb, nb_generation) if n_nb is not None else None
+    return n_nb
+
+
+def close_netbox(n_nb):
+    """Writes the cache of a writable cachedpynetbox handle to disk and
+    closes it"""
+    close = getattr(n_nb, "close", None)
+    if callable(close):
+        close()
+        return
+    # cachedpynetbox has no public close yet, fail loudly once its internals
+    # change instead of leaving the cache unsynced
+    try:
+        db = n_nb._snb._cache.db
+    except AttributeError:
+        raise RuntimeError(
+            "don't know how to close the cache of %s" % (type(n_nb).__name__,)
+        )
+    db.sync()
+    db.close()
 
 
 def get_nb():
-    global nb
-    return nb
+    """Returns the netbox handle, calls made through it are seen by input
+    recordings"""
+    return _observed
+
+
+def nb_generation():
+    """Returns a token that changes whenever the netbox cache is swapped out"""
+    if nb_dbpath is None:
+        return (id(nb),)
+    # the updater renames a fresh cache over the old one, so inode and mtime
+    # of the cache file identify a generation
+    try:
+        st = os.stat(nb_dbpath)
+    except OSError:
+        return (id(nb),)
+    return (id(nb), st.st_ino, st.st_mtime_ns)
+
+
+def get_topology():
+    """Returns the topology graph for the current netbox cache generation"""
+    global _topology
+    generation = nb_generation()
+    graph = _topology
+    if graph is None or graph.generation != generation:
+        graph = _topology = TopologyGraph(nb, generation)
+    return graph
 
 
 def iface_get_remote_name(iface):
-    if iface["type"]["value"] == "lag":
-        members = nb.lag_members_by_iface(iface)
-        if len(members) > 0:
-            iface = nb.lag_members_by_iface(iface)[0]
-        else:
-            return None
-    return ((iface.get("connected_endpoints") or [{}])[0].get("device") or {}).get(
-        "name"
-    )
+    return get_topology().remote_name(iface)
 
 
 def iface_get_remote_device(iface):
-    remote = iface_get_remote_name(iface)
-    if not remote:
-        return None
-
-    remote = nb.dev_by_name(remote)
-    if len(remote) > 1:
-        raise ValueError("port %r has more than 1 remote device" % (iface))
-    if len(remote) == 1:
-        return remote[0]
-    return None
+    return get_topology().remote_device(iface)
 
 
 def iter_iface_down(device, rootiface):
+    graph = get_topology()
     visited = set([device])
-    current_device = nb.dev_by_name(device)[0]
+    current_device = graph.device(device)
     default_access_vlan = current_device["custom_fields"].get(
         "default_access_vlan", None
     )
-    ifqueue = [(device, rootiface, default_access_vlan)]
+    ifqueue = deque([(device, rootiface, default_access_vlan)])
 
     current_role = current_device.get("device_role").get("slug")
     # always iter down to access switches, if we are a a core devices also
@@ -74,15 +116,15 @@ def iter_iface_down(device, rootiface):
         down_stream_role.append(ROLE_DISTRIBUTION_SWITCH)
 
     while len(ifqueue) > 0:
-        dev, iface, default_access_vlan = ifqueue.pop(0)
-        remote = iface_get_remote_device(iface)
+        dev, iface, default_access_vlan = ifqueue.popleft()
+        remote = graph.remote_device(iface)
         if remote:
             remote_role = remote.get("device_role").get("slug")
             # only iter downstream to devices that we know are below us
             if remote_role in down_stream_role and not remote["name"] in visited:
                 visited.add(remote["name"])
                 # append all interfaces of remote device to queue
-                for rmtif in nb.int_by_device_name(remote["name"]):
+                for rmtif in graph.int_by_device_name(remote["name"]):
                     # if no default_access_vlan is defined iherit it from the parent
                     ifqueue.append(
                         (
@@ -98,7 +140,15 @@ def iter_iface_down(device, rootiface):
 
 
 def is_facing_core(device):
-    for dev, depth in iter_devices_up(device["name"]):
+    """Returns the first core device found walking up from device (memoized)"""
+    name = device["name"]
+    return upstream_core_memo.lookup(
+        nb_generation(), name, lambda: _find_upstream_core(name)
+    )
+
+
+def _find_upstream_core(device):
+    for dev, depth in iter_devices_up(device):
         if dev.get("role").get("slug") not in [
             ROLE_ACCESS_SWITCH,
             ROLE_DISTRIBUTION_SWITCH,
@@ -110,13 +160,14 @@ def is_facing_core(device):
 def iter_devices_up(device, distro_only=True):
     """Start at some switch, iterate devices towards core"""
 
-    device = nb.dev_by_name(device)
+    graph = get_topology()
+    device = graph.device(device)
 
-    devqueue = [(device[0], 0)]
-    visited = set([device[0]["name"]])
+    devqueue = deque([(device, 0)])
+    visited = set([device["name"]])
 
     while len(devqueue) > 0:
-        device, depth = devqueue.pop(0)
+        device, depth = devqueue.popleft()
         yield device, depth
 
         role = device.get("device_role").get("slug")
@@ -124,11 +175,11 @@ def iter_devices_up(device, distro_only=True):
         if role not in [ROLE_ACCESS_SWITCH, ROLE_DISTRIBUTION_SWITCH]:
             return
 
-        for iface in nb.int_by_device_name(device["name"]):
+        for iface in graph.int_by_device_name(device["name"]):
             enabled = iface.get("enabled", True)
             if not enabled:
                 continue
-            remote = iface_get_remote_device(iface)
+            remote = graph.remote_device(iface)
             if remote is None:
                 continue
             if remote["name"] in visited:
@@ -142,7 +193,14 @@ def iter_devices_up(device, distro_only=True):
 
 
 def find_default_vlan(device):
-    current_device = nb.dev_by_name(device)[0]
+    """Returns the first default_access_vlan found walking up from device (memoized)"""
+    return default_vlan_memo.lookup(
+        nb_generation(), device, lambda: _find_default_vlan(device)
+    )
+
+
+def _find_default_vlan(device):
+    current_device = get_topology().device(device)
     role = current_device.get("device_role").get("slug")
     for device, depth in iter_devices_up(device, role == ROLE_DISTRIBUTION_SWITCH):
         vlanid = device["custom_fields"].get("default_access_vlan", None)
@@ -157,93 +215,201 @@ def iface_get_untagged(device, iface, implicit=True):
         return explicit
     if implicit:
         if iface["type"]["value"] not in ["Link Aggregation Group (LAG)", "Virtual"]:
-            current_device = nb.dev_by_name(device)[0]
+            current_device = get_topology().device(device)
             role = current_device.get("device_role").get("slug")
 
             return find_default_vlan(device)
 
 
-def get_vlans_on_iface(vlans_all, device, iface):
-    vlans = set([])
-    vlans_root = set([])
+def iface_vlans(device, iface, default_access_vlan):
+    """vlans a single interface carries by itself (tagged, untagged or default)"""
+    # vlans to add to the interface
+    add_vlans = set()
+    # check for tagged vlans
+    tagged_vlans = iface.get("tagged_vlans", [])
+    if len(tagged_vlans) > 0:
+        add_vlans.update([v.get("vid") for v in tagged_vlans])
+
+    # check for untagged vlans
+    untagged = iface_get_untagged(device, iface, False)
+    if untagged is not None:
+        add_vlans.add(untagged)
+    # no tagged nor untagged vlans -> so default vlan
+    elif len(tagged_vlans) < 1 and default_access_vlan is not None:
+        add_vlans.add(default_access_vlan)
+
+    # probably just affects non-standard management vlan interfaces
+    m = VLAN_IFACE_RE.match(iface["name"])
+    if m:
+        add_vlans.add(int(m.groups()[1]))
+    return add_vlans
+
+
+class DownstreamVlans(object):
+    """Resolves the vlans needed on the ports of one device
+
+    A port needs the vlans of every interface below it, the part of the
+    topology that iter_iface_down reaches through the port. That is the
+    port's remote plus everything connected to it through downstream
+    devices, without passing through the device itself. The aggregated
+    vlans of such a subtree are computed in a single traversal the first
+    time a port leads into it and reused for every further port (lag
+    members, parallel links) that leads into it, so resolving all ports
+    of a device costs one pass over the topology below it.
+    """
+
+    def __init__(self, graph, vlans_all, device):
+        self.graph = graph
+        self.vlans_all = vlans_all
+        self.device = device
+
+        current_device = graph.device(device)
+        self.default_access_vlan = current_device["custom_fields"].get(
+            "default_access_vlan", None
+        )
+        # always iter down to access switches, if we are a a core devices also
+        # iterate down into access switches
+        self.down_stream_role = [ROLE_ACCESS_SWITCH]
+        if current_device.get("device_role").get("slug") not in [
+            ROLE_ACCESS_SWITCH,
+            ROLE_DISTRIBUTION_SWITCH,
+        ]:
+            self.down_stream_role.append(ROLE_DISTRIBUTION_SWITCH)
 
-    remote0 = (None,)
+        # remote device name -> (vlans, vlans_root) of everything below it
+        self._subtrees = {}
+        # core device name -> vlans it is the origin of
+        self._origins = {}
 
-    current_device = nb.dev_by_name(device)[0]
-    role = current_device.get("device_role").get("slug")
-
-    # walk interace down
-    for dev, deviface, remote, default_access_vlan in iter_iface_down(device, iface):
-        if remote0 == (None,):
-            remote0 = remote
+    def _is_downstream(self, remote):
+        return (
+            remote.get("device_role").get("slug") in self.down_stream_role
+            and remote["name"] != self.device
+        )
 
+    def _origin_vlans(self, remote):
         # If there is a remote, mark it as the origin for all vlans
         # TODO: if the depth is more then 1 mark the interface as tagged_all somehow
-        if remote is not None and (remote_core := is_facing_core(remote)) is not None:
-            for vid in vlans_all:
-                if site.is_vlan_origin(
-                    FakeDevice(remote_core["name"], remote_core["device_role"]["slug"]),
-                    vid,
-                ):
-                    vlans_root.add(vid)
-
-        # vlans to add to the interface
-        add_vlans = set()
-        # check for tagged vlans
-        tagged_vlans = deviface.get("tagged_vlans", [])
-        if len(tagged_vlans) > 0:
-            add_vlans.update([v.get("vid") for v in tagged_vlans])
-
-        # check for untagged vlans
-        untagged = iface_get_untagged(dev, deviface, False)
-        if untagged is not None:
-            add_vlans.add(untagged)
-        # no tagged nor untagged vlans -> so default vlan
-        elif len(tagged_vlans) < 1 and default_access_vlan is not None:
-            add_vlans.add(default_access_vlan)
-
-        # probably just affects non-standard management vlan interfaces
-        m = VLAN_IFACE_RE.match(deviface["name"])
-        if m:
-            add_vlans.add(int(m.groups()[1]))
-
-        # add queried vlans to the interface
-        vlans.update(add_vlans)
-        tags = get_tags(iface)
-    # if we have a remote use the explict configured untagged, same if we have tagged vlans or
-    # a uplink tag, otherwise iterate upwards until we find the first device with a
-    # default_access_vlan
-    untagged = iface_get_untagged(
-        device,
-        iface,
-        remote0 is None
-        and len(iface.get("tagged_vlans", [])) == 0
-        and "uplink" not in tags,
-    )
+        core = is_facing_core(remote)
+        if core is None:
+            return set()
+        vlans = self._origins.get(core["name"])
+        if vlans is None:
+            fake = FakeDevice(core["name"], core["device_role"]["slug"])
+            vlans = self._origins[core["name"]] = set(
+                [vid for vid in self.vlans_all if site.is_vlan_origin(fake, vid)]
+            )
+        return vlans
+
+    def _subtree(self, entry):
+        result = self._subtrees.get(entry["name"])
+        if result is not None:
+            return result
+
+        vlans = set()
+        remotes = {}
+        inherited = False
+        # breadth first like iter_iface_down, so devices inherit the
+        # default_access_vlan of the same parent
+        visited = set([self.device, entry["name"]])
+        devqueue = deque(
+            [
+                (
+                    entry,
+                    entry["custom_fields"].get(
+                        "default_access_vlan", self.default_access_vlan
+                    ),
+                )
+            ]
+        )
+        while len(devqueue) > 0:
+            dev, default_access_vlan = devqueue.popleft()
+            if "default_access_vlan" not in dev["custom_fields"]:
+                inherited = True
+            for iface in self.graph.int_by_device_name(dev["name"]):
+                remote = self.graph.remote_device(iface)
+                if remote is not None:
+                    remotes[remote["name"]] = remote
+                    if (
+                        remote.get("device_role").get("slug") in self.down_stream_role
+                        and not remote["name"] in visited
+                    ):
+                        visited.add(remote["name"])
+                        # if no default_access_vlan is defined iherit it from the parent
+                        devqueue.append(
+                            (
+                                remote,
+                                remote["custom_fields"].get(
+                                    "default_access_vlan", default_access_vlan
+                                ),
+                            )
+                        )
+                vlans.update(iface_vlans(dev["name"], iface, default_access_vlan))
+
+        vlans_root = set()
+        for remote in remotes.values():
+            vlans_root.update(self._origin_vlans(remote))
+
+        result = (vlans, vlans_root)
+        # every port leading into the same part of the topology reaches the
+        # same devices, the result only depends on the entry point if a
+        # device inherited its default_access_vlan along the way
+        if inherited:
+            visited = set([entry["name"]])
+        for name in visited - set([self.device]):
+            self._subtrees[name] = result
+        return result
+
+    def vlans_on_iface(self, iface):
+        remote = self.graph.remote_device(iface)
+        vlans = iface_vlans(self.device, iface, self.default_access_vlan)
+        vlans_root = set()
+        if remote is not None:
+            vlans_root.update(self._origin_vlans(remote))
+            if self._is_downstream(remote):
+                sub_vlans, sub_vlans_root = self._subtree(remote)
+                vlans.update(sub_vlans)
+                vlans_root.update(sub_vlans_root)
+
+        # if we have a remote use the explict configured untagged, same if we have tagged vlans or
+        # a uplink tag, otherwise iterate upwards until we find the first device with a
+        # default_access_vlan
+        untagged = iface_get_untagged(
+            self.device,
+            iface,
+            remote is None
+            and len(iface.get("tagged_vlans", [])) == 0
+            and "uplink" not in get_tags(iface),
+        )
+
+        vlans.discard(None)
+        return untagged, vlans, vlans_root, remote
 
-    if None in vlans:
-        vlans.remove(None)
-    return untagged, set(vlans), set(vlans_root), remote0
+
+def get_vlans_on_iface(vlans_all, device, iface):
+    """Resolves a single port, for all ports of a device use one
+    DownstreamVlans so the topology below them is walked once"""
+    return DownstreamVlans(get_topology(), vlans_all, device).vlans_on_iface(iface)
 
 
 def collect_access_vlans(t_switch):
-    global nb
     accessifs = []
     access_vlans = set([])
     lagifs = []
-    lags = {}
     ifdata = {}
     vlan_directions = {}
+    iface_directions = {}
 
     # Gather all known vlans from netbox
-    vlans_all = set([vlan["vid"] for vlan in nb.vlans()])
+    vlans_all = set([vlan["vid"] for vlan in get_nb().vlans()])
+
+    graph = get_topology()
+    downstream = DownstreamVlans(graph, vlans_all, t_switch)
 
     # get all interfaces form netbox
-    for iface in nb.int_by_device_name(t_switch):
+    for iface in graph.int_by_device_name(t_switch):
         # get vlans on the device
-        untagged, vlans, vlans_root, remote = get_vlans_on_iface(
-            vlans_all, t_switch, iface
-        )
+        untagged, vlans, vlans_root, remote = downstream.vlans_on_iface(iface)
         ifdata[iface["name"]] = (untagged, vlans, remote)
 
         for vid in vlans | vlans_root:
@@ -251,9 +417,10 @@ def collect_access_vlans(t_switch):
                 continue
             ## store vlan -> interface mapping (for for example HP)
             vlan_directions.setdefault(vid, set([])).add(iface["name"])
+            iface_directions.setdefault(iface["name"], set([])).add(vid)
 
     # Second pass
-    for iface in nb.int_by_device_name(t_switch):
+    for iface in graph.int_by_device_name(t_switch):
         enabled = iface.get("enabled", True)
         lag = (iface.get("lag") or {}).get("name")
 
@@ -263,10 +430,9 @@ def collect_access_vlans(t_switch):
 
         ifname = iface.get("name")
         untagged, vlans, remote = ifdata[ifname]
-        for vid, ports in vlan_directions.items():
-            if len(ports) == 1:
-                continue
-            if iface["name"] in ports:
+        # vlans seen in more than one direction have to pass this port
+        for vid in iface_directions.get(ifname, []):
+            if len(vlan_directions[vid]) > 1:
                 vlans.add(vid)
 
         tags = get_tags(iface)
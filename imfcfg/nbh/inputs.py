@@ -0,0 +1,137 @@
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+# (generation, call key -> (digest, object keys)), swapped as a whole like
+# the GenerationMemo state
+_digests = (None, {})
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _arg_key(arg):
+    # netbox records are passed around as dicts, they are identified by id
+    if isinstance(arg, dict):
+        return ("id", arg.get("id"))
+    if isinstance(arg, list):
+        return tuple(_arg_key(a) for a in arg)
+    return arg
+
+
+def _object_key(obj):
+    return obj.get("url") or obj.get("id")
+
+
+def _digest(result):
+    """Returns (digest, object keys) of a netbox call result"""
+    data = json.dumps(result, sort_keys=True, default=repr).encode("utf-8")
+    objects = []
+    if isinstance(result, dict):
+        result = [result]
+    if isinstance(result, list):
+        objects = [_object_key(r) for r in result if isinstance(r, dict)]
+    return hashlib.sha1(data).hexdigest(), frozenset(o for o in objects if o)
+
+
+def call_digest(generation, method, args, result):
+    """Returns the call key and (digest, object keys) of a netbox call, the
+    digest is computed once per call and cache generation"""
+    global _digests
+    key = (method, tuple(_arg_key(a) for a in args))
+    state = _digests
+    if generation != state[0]:
+        state = _digests = (generation, {})
+    value = state[1].get(key)
+    if value is None:
+        value = state[1][key] = _digest(result)
+    return key, value
+
+
+class InputSet(object):
+    """The netbox calls a render made and a digest of what each returned"""
+
+    def __init__(self):
+        # call key -> (method, args, digest)
+        self.calls = {}
+        self.objects = set()
+
+    def add(self, generation, method, args, result):
+        key, (digest, objects) = call_digest(generation, method, args, result)
+        if key not in self.calls:
+            self.calls[key] = (method, args, digest)
+            self.objects.update(objects)
+
+    def update(self, other):
+        for key, call in other.calls.items():
+            self.calls.setdefault(key, call)
+        self.objects.update(other.objects)
+
+    def fingerprint(self):
+        h = hashlib.sha1()
+        for key in sorted(self.calls, key=repr):
+            h.update(("%r=%s\n" % (key, self.calls[key][2])).encode("utf-8"))
+        return h.hexdigest()
+
+    def __len__(self):
+        return len(self.calls)
+
+
+@contextmanager
+def recording_inputs():
+    """Records the netbox calls made in this thread until the block is left,
+    nested recordings are added to the enclosing one"""
+    inputs = InputSet()
+    stack = _stack()
+    stack.append(inputs)
+    try:
+        yield inputs
+    finally:
+        stack.pop()
+        if stack:
+            stack[-1].update(inputs)
+
+
+def is_recording():
+    return bool(_stack())
+
+
+def record_call(generation, method, args, result):
+    stack = _stack()
+    if stack:
+        stack[-1].add(generation, method, args, result)
+
+
+def record_inputs(inputs):
+    """Adds previously recorded inputs to the current recording"""
+    stack = _stack()
+    if stack and inputs is not None:
+        stack[-1].update(inputs)
+
+
+class ObservedNetbox(object):
+    """Wraps a netbox handle and records every call made through it"""
+
+    def __init__(self, netbox, generation):
+        self._nb = netbox
+        self._generation = generation
+
+    def __getattr__(self, name):
+        attr = getattr(self._nb, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if _stack() and not kwargs:
+                record_call(self._generation(), name, args, result)
+            return result
+
+        return call
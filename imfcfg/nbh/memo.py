@@ -0,0 +1,63 @@
+from .inputs import is_recording, recording_inputs, record_inputs
+
+_MISSING = object()
+
+
+class GenerationMemo(object):
+    """Memoizes a per-device result for one netbox cache generation
+
+    All entries are dropped as soon as a lookup is done for another generation.
+    hits/misses are kept across generations so the hit ratio can be checked.
+    Computed while an input recording is active, the netbox inputs of a
+    result are stored with it and added to the recording on every hit.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        # (generation, values) swapped as a whole, so results computed while
+        # another thread moved on to a new generation end up in the old dict
+        self._state = (None, {})
+
+    @property
+    def generation(self):
+        return self._state[0]
+
+    def lookup(self, generation, key, compute):
+        state = self._state
+        if generation != state[0]:
+            state = self._state = (generation, {})
+        values = state[1]
+        recording = is_recording()
+        entry = values.get(key, _MISSING)
+        # entries computed outside of a recording don't know their inputs
+        if entry is not _MISSING and (entry[1] is not None or not recording):
+            self.hits += 1
+            record_inputs(entry[1])
+            return entry[0]
+        self.misses += 1
+        if not recording:
+            value = compute()
+            values[key] = (value, None)
+            return value
+        with recording_inputs() as inputs:
+            value = compute()
+        values[key] = (value, inputs)
+        return value
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._state[1]),
+        }
+
+
+upstream_core_memo = GenerationMemo("upstream_core")
+default_vlan_memo = GenerationMemo("default_access_vlan")
+
+
+def memo_stats():
+    """Returns the hit/miss counters of the upstream resolution memos"""
+    return dict((m.name, m.stats()) for m in [upstream_core_memo, default_vlan_memo])
@@ -0,0 +1,147 @@
+import ipaddress as ipaddr
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+from .helper import get_nb, nb_generation
+from .memo import GenerationMemo
+
+
+@lru_cache(maxsize=65536)
+def _parse(value):
+    """Returns (version, first, last, prefixlen) of an address, an address
+    with mask (as netbox stores ip addresses) or a network"""
+    if "/" in value:
+        iface = ipaddr.ip_interface(value)
+        if iface.ip != iface.network.network_address:
+            # address with mask, the address is what is looked up
+            ip = int(iface.ip)
+            return iface.version, ip, ip, iface.max_prefixlen
+        net = iface.network
+    else:
+        net = ipaddr.ip_network(value)
+    return (
+        net.version,
+        int(net.network_address),
+        int(net.broadcast_address),
+        net.prefixlen,
+    )
+
+
+def parse_prefix(value):
+    return _parse(str(value))
+
+
+class _Table(object):
+    """Prefixes of one address family sorted by (first address, length)
+
+    CIDR prefixes are either nested or disjoint, so every prefix containing
+    an address is an ancestor of the last prefix starting at or before it.
+    """
+
+    def __init__(self, entries):
+        entries.sort(key=lambda e: (e[0], e[2]))
+        self.starts = [e[0] for e in entries]
+        self.ends = [e[1] for e in entries]
+        self.lens = [e[2] for e in entries]
+        self.records = [e[3] for e in entries]
+        # index of the closest enclosing prefix, -1 for top level prefixes
+        self.parents = []
+        stack = []
+        for i, (start, end, plen, record) in enumerate(entries):
+            while stack and self.ends[stack[-1]] < start:
+                stack.pop()
+            self.parents.append(stack[-1] if stack else -1)
+            stack.append(i)
+
+    def containing(self, first, last, plen):
+        i = bisect_right(self.starts, first) - 1
+        while i >= 0:
+            if self.ends[i] >= last and self.lens[i] <= plen:
+                yield i
+            i = self.parents[i]
+
+    def under(self, first, last, plen):
+        lo = bisect_left(self.starts, first)
+        hi = bisect_right(self.starts, last)
+        return [i for i in range(lo, hi) if self.lens[i] >= plen]
+
+
+class PrefixIndex(object):
+    """Index over netbox prefixes answering containment queries in
+    logarithmic time
+
+    Addresses, addresses with mask and networks can be given as strings or
+    ipaddress objects, results are the netbox prefix records.
+    """
+
+    def __init__(self, prefixes):
+        entries = {}
+        for p in prefixes:
+            version, first, last, plen = parse_prefix(p["prefix"])
+            entries.setdefault(version, []).append((first, last, plen, p))
+        self._tables = dict((v, _Table(e)) for v, e in entries.items())
+
+    def __len__(self):
+        return sum(len(t.records) for t in self._tables.values())
+
+    def containing(self, value):
+        """Returns the most specific prefix containing value, None if there
+        is none"""
+        for prefix in self.all_containing(value):
+            return prefix
+        return None
+
+    def all_containing(self, value):
+        """Returns all prefixes containing value, most specific first"""
+        version, first, last, plen = parse_prefix(value)
+        table = self._tables.get(version)
+        if table is None:
+            return []
+        return [table.records[i] for i in table.containing(first, last, plen)]
+
+    def under(self, value):
+        """Returns all prefixes inside (or equal to) the network value"""
+        version, first, last, plen = parse_prefix(value)
+        table = self._tables.get(version)
+        if table is None:
+            return []
+        return [table.records[i] for i in table.under(first, last, plen)]
+
+
+def prefix_within(inner, outer):
+    """Returns True if the address or network inner is inside (or equal to)
+    the network outer"""
+    version, first, last, plen = parse_prefix(inner)
+    o_version, o_first, o_last, o_plen = parse_prefix(outer)
+    return version == o_version and o_first <= first and last <= o_last
+
+
+prefix_index_memo = GenerationMemo("prefix_index")
+
+
+def get_prefix_index():
+    """Returns the index over all active prefixes of the current netbox
+    cache generation"""
+    return prefix_index_memo.lookup(
+        nb_generation(),
+        None,
+        lambda: PrefixIndex(
+            p for p in get_nb().prefixes() if p["status"]["value"] == "active"
+        ),
+    )
+
+
+def prefix_of(value):
+    """jinja2 global, the most specific active prefix containing value"""
+    return get_prefix_index().containing(value)
+
+
+def prefixes_under(value):
+    """jinja2 global, all active prefixes inside the network value"""
+    return get_prefix_index().under(value)
+
+
+def register_prefix_globals(templateEnv):
+    templateEnv.globals.update(prefix_of=prefix_of)
+    templateEnv.globals.update(prefix_in=prefix_within)
+    templateEnv.globals.update(prefixes_under=prefixes_under)
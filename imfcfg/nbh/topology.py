@@ -0,0 +1,74 @@
+from .inputs import record_call
+
+
+class TopologyGraph(object):
+    """In-memory cabling graph (device -> interfaces -> remote device) for one
+    netbox cache generation. Every device, interface list, lag membership and
+    remote is fetched from netbox at most once and then served from memory.
+    Lookups are recorded as netbox calls, cached or not, so input recordings
+    see everything a render read through the graph.
+    """
+
+    def __init__(self, netbox, generation=None):
+        self._nb = netbox
+        self.generation = generation
+        # device name -> list of devices as returned by dev_by_name
+        self._devices = {}
+        # device name -> list of interfaces
+        self._ifaces = {}
+        # lag interface id -> list of member interfaces
+        self._lag_members = {}
+
+    def dev_by_name(self, name):
+        devices = self._devices.get(name)
+        if devices is None:
+            devices = self._devices[name] = self._nb.dev_by_name(name)
+        record_call(self.generation, "dev_by_name", (name,), devices)
+        return devices
+
+    def device(self, name):
+        return self.dev_by_name(name)[0]
+
+    def int_by_device_name(self, name):
+        ifaces = self._ifaces.get(name)
+        if ifaces is None:
+            ifaces = self._ifaces[name] = self._nb.int_by_device_name(name)
+        record_call(self.generation, "int_by_device_name", (name,), ifaces)
+        return ifaces
+
+    def lag_members(self, iface):
+        members = self._lag_members.get(iface["id"])
+        if members is None:
+            members = self._lag_members[iface["id"]] = self._nb.lag_members_by_iface(
+                iface
+            )
+        record_call(self.generation, "lag_members_by_iface", (iface,), members)
+        return members
+
+    def _endpoint(self, iface):
+        if iface["type"]["value"] == "lag":
+            members = self.lag_members(iface)
+            if len(members) == 0:
+                return {}
+            iface = members[0]
+        return (iface.get("connected_endpoints") or [{}])[0]
+
+    def remote_name(self, iface):
+        return (self._endpoint(iface).get("device") or {}).get("name")
+
+    def remote_iface_name(self, iface):
+        return self._endpoint(iface).get("name")
+
+    def remote_device(self, iface):
+        remote = self.remote_name(iface)
+        if not remote:
+            return None
+        remote = self.dev_by_name(remote)
+        if len(remote) > 1:
+            raise ValueError("port %r has more than 1 remote device" % (iface))
+        return remote[0] if len(remote) == 1 else None
+
+    def links(self, name):
+        """yields (interface, remote device) for every interface of a device"""
+        for iface in self.int_by_device_name(name):
+            yield iface, self.remote_device(iface)
@@ -0,0 +1,205 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from . import inputs
+
+_local = threading.local()
+
+# frames of the netbox wrappers, call sites are the first frames outside
+_WRAPPER_FILES = set(
+    os.path.splitext(os.path.abspath(f))[0] for f in [__file__, inputs.__file__]
+)
+
+# frames kept of the stack of a call site
+STACK_DEPTH = 4
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _describe(arg):
+    # netbox records are passed around as dicts, named by name and id
+    if isinstance(arg, dict):
+        return "%s#%s" % (arg.get("name") or "", arg.get("id"))
+    if isinstance(arg, list):
+        return "[%s]" % ", ".join(_describe(a) for a in arg)
+    return repr(arg)
+
+
+def _frame_file(frame):
+    return os.path.splitext(os.path.abspath(frame.f_code.co_filename))[0]
+
+
+def _call_site(frame):
+    """Returns the innermost STACK_DEPTH frames calling into the wrappers as
+    ("dir/file.py:line function", ...)"""
+    while frame is not None and _frame_file(frame) in _WRAPPER_FILES:
+        frame = frame.f_back
+    site = []
+    while frame is not None and len(site) < STACK_DEPTH:
+        code = frame.f_code
+        path = code.co_filename.split(os.sep)
+        site.append("%s:%d %s" % ("/".join(path[-2:]), frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    return tuple(site)
+
+
+class MethodTrace(object):
+    """The calls of one netbox method: by argument and by call site"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.args = Counter()
+        self.sites = Counter()
+
+    @property
+    def repeated(self):
+        """Calls with arguments the method was called with before"""
+        return self.calls - len(self.args)
+
+    def update(self, other):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.args.update(other.args)
+        self.sites.update(other.sites)
+
+    def to_dict(self, top=5):
+        return {
+            "calls": self.calls,
+            "distinct": len(self.args),
+            "repeated": self.repeated,
+            "seconds": round(self.seconds, 6),
+            "repeated_args": [
+                [arg, count] for arg, count in self.args.most_common(top) if count > 1
+            ],
+            "call_sites": [
+                [list(site), count] for site, count in self.sites.most_common(top)
+            ],
+        }
+
+
+class CallTrace(object):
+    """The netbox calls made while tracing, by method"""
+
+    def __init__(self):
+        # method name -> MethodTrace
+        self.methods = {}
+
+    def add(self, method, args, seconds, site):
+        trace = self.methods.get(method)
+        if trace is None:
+            trace = self.methods[method] = MethodTrace()
+        trace.calls += 1
+        trace.seconds += seconds
+        trace.args[args] += 1
+        trace.sites[site] += 1
+
+    def update(self, other):
+        for method, trace in other.methods.items():
+            self.methods.setdefault(method, MethodTrace()).update(trace)
+
+    @property
+    def calls(self):
+        return sum(t.calls for t in self.methods.values())
+
+    @property
+    def seconds(self):
+        return sum(t.seconds for t in self.methods.values())
+
+    def _by_time(self):
+        return sorted(self.methods.items(), key=lambda m: -m[1].seconds)
+
+    def to_dict(self, top=5):
+        return {
+            "calls": self.calls,
+            "seconds": round(self.seconds, 6),
+            "methods": dict(
+                (method, trace.to_dict(top)) for method, trace in self._by_time()
+            ),
+        }
+
+    def report(self, top=3):
+        """Returns the calls as text, the methods that took longest first"""
+        lines = [
+            "netbox calls: %d in %.1fms" % (self.calls, self.seconds * 1000),
+            "%-24s %7s %9s %9s %10s"
+            % ("method", "calls", "distinct", "repeated", "time"),
+        ]
+        for method, trace in self._by_time():
+            lines.append(
+                "%-24s %7d %9d %9d %8.1fms"
+                % (
+                    method,
+                    trace.calls,
+                    len(trace.args),
+                    trace.repeated,
+                    trace.seconds * 1000,
+                )
+            )
+            repeated = [(a, c) for a, c in trace.args.most_common(top) if c > 1]
+            if repeated:
+                lines.append(
+                    "    repeated: %s"
+                    % ", ".join(
+                        "%s(%s) x%d" % (method, arg, count) for arg, count in repeated
+                    )
+                )
+            for site, count in trace.sites.most_common(top):
+                lines.append("    %5dx from %s" % (count, " < ".join(site)))
+        return "\n".join(lines) + "\n"
+
+
+class TracingNetbox(object):
+    """Wraps a netbox handle, calls made through it while tracing_calls is
+    active in the same thread are counted, timed and their call sites kept"""
+
+    def __init__(self, netbox):
+        self._nb = netbox
+
+    def __getattr__(self, name):
+        attr = getattr(self._nb, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            stack = _stack()
+            if not stack:
+                return attr(*args, **kwargs)
+            site = _call_site(sys._getframe(1))
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                key = ", ".join(
+                    [_describe(a) for a in args]
+                    + ["%s=%s" % (k, _describe(v)) for k, v in sorted(kwargs.items())]
+                )
+                stack[-1].add(name, key, time.perf_counter() - start, site)
+
+        return call
+
+
+@contextmanager
+def tracing_calls(trace=None):
+    """Traces the netbox calls made in this thread until the block is left,
+    into trace or a new CallTrace. Nested traces are added to the enclosing
+    one."""
+    if trace is None:
+        trace = CallTrace()
+    stack = _stack()
+    stack.append(trace)
+    try:
+        yield trace
+    finally:
+        stack.pop()
+        if stack:
+            stack[-1].update(trace)
@@ -1 +1,2 @@
 from .main import *
+from .cache import *
@@ -0,0 +1,176 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from imfcfg.junosdiff import config_patch
+
+
+class RenderedConfig(object):
+    def __init__(self, device, generation, path, mtime, body, uptodate):
+        self.device = device
+        self.generation = generation
+        # template the config was rendered from and its mtime at render time
+        self.path = path
+        self.mtime = mtime
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()
+        self.uptodate = uptodate
+
+    def __repr__(self):
+        return "<RenderedConfig %s: %d bytes, %s>" % (
+            self.device,
+            len(self.body),
+            self.etag[:12],
+        )
+
+
+class RenderCache(object):
+    """In-process cache of rendered device configs
+
+    Entries are valid for one netbox cache generation and as long as the
+    template they were rendered from did not change. The cache is bounded by
+    the total size of the cached configs, least recently used entries are
+    evicted first.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, device, generation):
+        with self._lock:
+            entry = self._entries.get(device)
+        if entry is None or entry.generation != generation or not entry.uptodate():
+            self.misses += 1
+            return None
+        with self._lock:
+            if device in self._entries:
+                self._entries.move_to_end(device)
+        self.hits += 1
+        return entry
+
+    def put(self, device, generation, path, mtime, body, uptodate):
+        entry = RenderedConfig(device, generation, path, mtime, body, uptodate)
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            old = self._entries.pop(device, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self._entries[device] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+        return entry
+
+    def rebase(self, device, generation, new_generation):
+        """Moves the entry of device rendered from generation to
+        new_generation, for configs known not to change with the new cache"""
+        with self._lock:
+            entry = self._entries.get(device)
+            if entry is None or entry.generation != generation:
+                return False
+            entry.generation = new_generation
+        return True
+
+    def invalidate(self, device=None):
+        with self._lock:
+            if device is None:
+                self._entries.clear()
+                self.size = 0
+            elif (old := self._entries.pop(device, None)) is not None:
+                self.size -= len(old.body)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, device):
+        return device in self._entries
+
+
+class ConfigHistory(object):
+    """Configs recently served to each device by ETag, the bases patches are
+    made against
+
+    Keeps the last depth configs of every device, bounded by their total
+    size, and the patches from older configs to the latest one.
+    """
+
+    def __init__(self, depth=8, max_bytes=64 * 1024 * 1024):
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.size = 0
+        # device -> OrderedDict(etag -> body), oldest first
+        self._configs = OrderedDict()
+        # device -> {(base etag, etag): patch}
+        self._patches = {}
+        self._lock = threading.Lock()
+
+    def add(self, rendered):
+        with self._lock:
+            configs = self._configs.get(rendered.device)
+            if configs is None:
+                configs = self._configs[rendered.device] = OrderedDict()
+            self._configs.move_to_end(rendered.device)
+            if rendered.etag in configs:
+                configs.move_to_end(rendered.etag)
+                return
+            configs[rendered.etag] = rendered.body
+            self.size += len(rendered.body)
+            # patches are only asked for against the latest config
+            self._patches.pop(rendered.device, None)
+            while len(configs) > self.depth:
+                _, body = configs.popitem(last=False)
+                self.size -= len(body)
+            while self.size > self.max_bytes and self._configs:
+                device, oldest = next(iter(self._configs.items()))
+                _, body = oldest.popitem(last=False)
+                self.size -= len(body)
+                if not oldest:
+                    del self._configs[device]
+                    self._patches.pop(device, None)
+
+    def get(self, device, etag):
+        with self._lock:
+            return self._configs.get(device, {}).get(etag)
+
+    def delta(self, device, base, rendered, patchable):
+        """Returns (mode, body) to send for rendered to a device that has
+        the config with the ETag base: ("patch", load replace patch) if
+        patchable and a patch can be made, ("full", config) otherwise"""
+        if patchable and base is not None:
+            try:
+                patch = self.patch(device, base, rendered)
+            except ValueError:
+                # not a junos config after all
+                patch = None
+            if patch is not None:
+                return "patch", patch
+        return "full", rendered.body
+
+    def patch(self, device, base, rendered):
+        """Returns the load replace patch from the config with the ETag base
+        to rendered, None if base is unknown or the configs only differ in
+        ways a patch doesn't carry (comments, order of statements). Raises
+        ValueError for configs that are no Junos configs."""
+        key = (base, rendered.etag)
+        with self._lock:
+            patch = self._patches.get(device, {}).get(key)
+        if patch is not None:
+            return patch or None
+        old = self.get(device, base)
+        if old is None:
+            return None
+        patch = config_patch(old.decode("UTF-8"), rendered.body.decode("UTF-8")).encode(
+            "UTF-8"
+        )
+        with self._lock:
+            if device in self._configs:
+                self._patches.setdefault(device, {})[key] = patch
+        # the config still changed, an empty patch would hide that
+        return patch or None
@@ -1,14 +1,40 @@
 import jinja2
 import os
 import re
+import sys
+import time
 import codecs
+import threading
+from collections import namedtuple
+from hashlib import sha1
 from imfcfg.util import *
 
 
-def init_template(nb, path=None):
+class TemplateBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """Bytecode cache keyed by template file instead of template name
+
+    Templates are looked up by device name, keyed by name every device
+    would get its own copy of the same compiled template. Stale entries are
+    detected by jinja through the checksum of the template source.
+    TemplateLoader.load compiles templates under their file name, so the
+    cached code doesn't depend on the device that was loaded first.
+    """
+
+    def get_cache_key(self, name, filename=None):
+        if filename is None:
+            return super().get_cache_key(name, filename)
+        return sha1(filename.encode("utf-8")).hexdigest()
+
+
+def init_template(nb, path=None, cache_path=None):
+    """cache_path is the directory of the bytecode cache shared by all
+    processes, by default a per-user directory in the temp dir"""
     loader = TemplateLoader(nb, path)
     templateEnv = jinja2.Environment(
-        loader=loader, trim_blocks=True, lstrip_blocks=True
+        loader=loader,
+        trim_blocks=True,
+        lstrip_blocks=True,
+        bytecode_cache=TemplateBytecodeCache(cache_path),
     )
     templateEnv.filters.update(nethost=nethost)
     templateEnv.filters.update(sortifnames=sortifnames)
@@ -26,12 +52,48 @@ def init_template(nb, path=None):
     return loader, templateEnv
 
 
+def precompile_templates(templateEnv, loader):
+    """Compiles all templates into the bytecode cache, returns the number of
+    templates compiled"""
+    loader.refresh_index(force=True)
+    count = 0
+    for path, data, headers in loader._index:
+        try:
+            templateEnv.get_template(os.path.basename(path))
+            count += 1
+        except jinja2.TemplateError as e:
+            sys.stderr.write("failed to compile template %s: %s\n" % (path, e))
+    return count
+
+
+TemplateHeader = namedtuple("TemplateHeader", "type rules important matchers")
+
+
+class InvalidRule(object):
+    """Stands in for a c3cfg regex that doesn't compile, lookups reaching it
+    fail with its re.error like they did before templates were indexed"""
+
+    def __init__(self, tpl, regex, error):
+        self.tpl = tpl
+        self.regex = regex
+        self.error = error
+
+    def match(self, value):
+        raise re.error(
+            "Template %s has invalid c3cfg regex %r: %s"
+            % (self.tpl, self.regex, self.error),
+            self.regex,
+        )
+
+
 class TemplateLoader(jinja2.BaseLoader):
     target_re = re.compile(
         "\{#\s*c3cfg:\s*(?P<type>router|switch)\s+(?P<rules>.*)\s+#\}"
     )
     default_role = "router"
     nb = None
+    # seconds between checks of the template directory for modifications
+    check_interval = 1.0
 
     def __init__(self, nb, path=None):
         self.nb = nb
@@ -41,6 +103,135 @@ class TemplateLoader(jinja2.BaseLoader):
             )
         else:
             self.path = path
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._checked = 0
+        # [(path, data, [TemplateHeader or None])] in directory order
+        self._index = None
+        self._mtimes = {}
+        self._mtimedir = None
+        # (name, device_type, device_role) -> candidates
+        self._selected = {}
+
+    @staticmethod
+    def parse_header(tpl, match):
+        """Compiles the rules of a {# c3cfg: ... #} header, None if the rules
+        are too short"""
+        rules = match.group("rules").split(" ")
+        matchers = []
+        important = False
+        while len(rules) > 0:
+            rule = rules.pop(0)
+            field = None
+            if rule in ["device_type", "device_role"]:
+                field = rule
+                if len(rules) < 1:
+                    sys.stderr.write(
+                        "Template %s has invalid c3cfg (rules too short)\n" % tpl
+                    )
+                    return None
+                regex = rules.pop(0)
+            elif rule == "important":
+                important = True
+                continue
+            else:
+                regex = rule
+            try:
+                matchers.append((field, re.compile(regex)))
+            except re.error as e:
+                sys.stderr.write(
+                    "Template %s has invalid c3cfg regex %r: %s\n" % (tpl, regex, e)
+                )
+                matchers.append((field, InvalidRule(tpl, regex, e)))
+        return TemplateHeader(
+            match.group("type"), match.group("rules"), important, matchers
+        )
+
+    def _build_index(self):
+        mtimedir = os.path.getmtime(self.path)
+        index = []
+        mtimes = {}
+        for tpl in os.listdir(self.path):
+            if tpl.startswith(".") or not tpl.endswith(".j2"):
+                continue
+            path = os.path.join(self.path, tpl)
+            mtimes[path] = os.path.getmtime(path)
+            with codecs.open(path, "r", "UTF-8") as f:
+                data = f.read()
+            headers = [
+                self.parse_header(tpl, match) for match in self.target_re.finditer(data)
+            ]
+            index.append((path, data, headers))
+
+        self._index = index
+        self._mtimes = mtimes
+        self._mtimedir = mtimedir
+        self._selected = {}
+        self._generation += 1
+
+    def _is_modified(self):
+        try:
+            if os.path.getmtime(self.path) != self._mtimedir:
+                return True
+            for path, mtime in self._mtimes.items():
+                if os.path.getmtime(path) != mtime:
+                    return True
+        except OSError:
+            return True
+        return False
+
+    def refresh_index(self, force=False):
+        """(Re)builds the template index if any template changed since it was
+        built, checks at most once every check_interval seconds"""
+        now = time.time()
+        if (
+            not force
+            and self._index is not None
+            and now - self._checked < self.check_interval
+        ):
+            return
+        with self._lock:
+            if force or self._index is None or self._is_modified():
+                self._build_index()
+            self._checked = now
+
+    def _select(self, name, device):
+        key = (
+            name,
+            (device.get("device_type") or {}).get("slug"),
+            (device.get("device_role") or {}).get("slug"),
+        )
+        selected = self._selected
+        candidates = selected.get(key)
+        if candidates is not None:
+            return candidates
+
+        # search templates using:
+        #   {# c3cfg: (router|switch) <name> [important] #}
+        candidates = []
+        important = False
+        values = {None: name, "device_type": key[1], "device_role": key[2]}
+        for path, data, headers in self._index:
+            for header in headers:
+                if header is None:
+                    continue
+                matched = True
+                for field, regex in header.matchers:
+                    if regex.match(values[field]) is None:
+                        matched = False
+                        break
+                if not matched:
+                    continue
+                if important and (not header.important):
+                    continue
+                if header.important:
+                    important = True
+                    candidates = []
+                candidates.append((path, header.rules, data, header.type))
+                break
+
+        selected[key] = candidates
+        return candidates
 
     def get_source_type(self, environment, name):
         from jinja2.exceptions import TemplateNotFound
@@ -71,59 +262,9 @@ class TemplateLoader(jinja2.BaseLoader):
             )
         device = device[0]
 
-        # search templates using:
-        #   {# c3cfg: (router|switch) <name> [important] #}
-        candidates = []
-        important = False
-        mtimedir = os.path.getmtime(self.path)
-
-        for tpl in os.listdir(self.path):
-            if tpl.startswith(".") or not tpl.endswith(".j2"):
-                continue
-            with codecs.open(os.path.join(self.path, tpl), "r", "UTF-8") as f:
-                data = f.read()
-            for match in self.target_re.finditer(data):
-                rules = match.group("rules").split(" ")
-                matched = True
-                this_imp = False
-                # process the rules
-                while len(rules) > 0:
-                    rule = rules.pop(0)
-                    match_val = name
-                    if rule in ["device_type", "device_role"]:
-                        match_val = device[rule]["slug"]
-                        if len(rules) < 1:
-                            sys.stderr.write(
-                                "Template %s has invalid c3cfg (rules too short)\n"
-                                % tpl
-                            )
-                            matched = False
-                            break
-                        regex = rules.pop(0)
-                    elif rule == "important":
-                        this_imp = True
-                        continue
-                    else:
-                        regex = rule
-                    if re.match(regex, match_val) is None:
-                        matched = False
-                        break
-                if not matched:
-                    continue
-                if important and (not this_imp):
-                    continue
-                if this_imp:
-                    important = True
-                    candidates = []
-                candidates.append(
-                    (
-                        os.path.join(self.path, tpl),
-                        match.group("rules"),
-                        data,
-                        match.group("type"),
-                    )
-                )
-                break
+        self.refresh_index()
+        generation = self._generation
+        candidates = self._select(name, device)
 
         if len(candidates) == 0:
             raise TemplateNotFound('no template matches host name "%s"' % (name))
@@ -136,17 +277,38 @@ class TemplateLoader(jinja2.BaseLoader):
                 )
             )
 
-        # directory mtime will pick up creation/deletion of files, but modifications
-        # of other files' regexes will go unnoticed... :/
         path, rules, data, typ = candidates[0]
-        mtime = os.path.getmtime(path)
 
+        # any modification of a template (including the rules of other
+        # templates) results in a new index generation
         def checkmodif():
-            return mtime == os.path.getmtime(path) and mtimedir == os.path.getmtime(
-                self.path
-            )
+            self.refresh_index()
+            return generation == self._generation
 
         return typ, data, path, checkmodif
 
     def get_source(self, *args, **kwargs):
         return tuple(self.get_source_type(*args, **kwargs)[1:])
+
+    def load(self, environment, name, globals=None):
+        """Like jinja2.BaseLoader.load, but compiles the template under the
+        name of its file, the bytecode is shared by all devices using it.
+        The template returned is named after the device."""
+        if globals is None:
+            globals = {}
+        source, filename, uptodate = self.get_source(environment, name)
+        code = None
+        bcc = environment.bytecode_cache
+        if bcc is not None:
+            bucket = bcc.get_bucket(environment, name, filename, source)
+            code = bucket.code
+        if code is None:
+            code = environment.compile(source, os.path.basename(filename), filename)
+            if bcc is not None:
+                bucket.code = code
+                bcc.set_bucket(bucket)
+        template = environment.template_class.from_code(
+            environment, code, globals, uptodate
+        )
+        template.name = name
+        return template
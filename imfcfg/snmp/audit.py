@@ -0,0 +1,175 @@
+import asyncio
+import csv
+import json
+from fnmatch import fnmatch
+
+from imfcfg.snmp.client import SnmpTimeout
+from imfcfg.snmp.tablewalk import lldp_loc_table, lldp_ports, lldp_rem_table
+from imfcfg.util import name_to_tuple
+
+# devices audited when no roles are given
+AUDIT_ROLES = ("access-switch", "distribution-switch")
+
+AUDIT_FIELDS = [
+    "device",
+    "interface",
+    "status",
+    "netbox_device",
+    "netbox_port",
+    "lldp_device",
+    "lldp_port",
+    "error",
+]
+
+# interfaces without a cable of their own
+SKIP_IFACE_TYPES = ["Link Aggregation Group (LAG)", "Virtual"]
+
+
+class LldpAudit(object):
+    """Compares the LLDP neighbours of many devices against netbox cabling
+
+    All devices are walked at the same time by one SnmpClient, which bounds
+    the number of walks in flight. Interface lists are fetched from netbox
+    once per device, however many neighbours refer to it.
+
+    Every interface that differs becomes a row with one of the status:
+        wrong_device       LLDP sees another device than netbox is cabled to
+        wrong_port         right device, LLDP sees another remote port
+        no_lldp            netbox has a cable, LLDP sees no neighbour
+        no_cable           LLDP sees a neighbour, netbox has no cable
+        unknown_interface  LLDP neighbour on an interface netbox doesn't know
+        unreachable        the device could not be walked, see error
+    Interfaces that match get the status ok.
+    """
+
+    def __init__(self, netbox, client):
+        self.nb = netbox
+        self.client = client
+        self._ifaces = {}
+
+    def interfaces(self, name):
+        """Returns {interface name: interface} of a device"""
+        ifaces = self._ifaces.get(name)
+        if ifaces is None:
+            ifaces = self._ifaces[name] = dict(
+                (i["name"], i) for i in self.nb.int_by_device_name(name)
+            )
+        return ifaces
+
+    def _known_port(self, device, port):
+        # remotes that send something else than their interface name as
+        # port id can only be checked by device
+        return port in self.interfaces(device)
+
+    def devices(self, roles=AUDIT_ROLES, patterns=None):
+        """Returns [(name, snmp ip)] of all devices with one of roles and a
+        name matching one of patterns"""
+        devices = []
+        for device in self.nb.devices():
+            if device["device_role"]["slug"] not in roles:
+                continue
+            if patterns and not any(fnmatch(device["name"], p) for p in patterns):
+                continue
+            ip4 = (device.get("primary_ip4") or {}).get("address")
+            if not ip4:
+                continue
+            devices.append((device["name"], ip4.split("/")[0]))
+        return sorted(devices, key=lambda d: name_to_tuple(d[0]))
+
+    async def _neighbours(self, snmpip):
+        rem_table, loc_table = await asyncio.gather(
+            self.client.get_table(snmpip, lldp_rem_table, 3),
+            self.client.get_table(snmpip, lldp_loc_table, 1),
+        )
+        return lldp_ports(rem_table, loc_table)
+
+    async def walk(self, snmpips, deadline):
+        """Returns snmpip -> lldp neighbours, or the exception of the failed
+        walk, for all snmpips. Walks still running after deadline seconds
+        are cancelled."""
+        tasks = dict(
+            (ip, asyncio.ensure_future(self._neighbours(ip))) for ip in snmpips
+        )
+        if not tasks:
+            return {}
+        done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        results = {}
+        for ip, task in tasks.items():
+            if task in pending:
+                results[ip] = SnmpTimeout("deadline of %gs passed" % (deadline,))
+            elif task.exception() is not None:
+                results[ip] = task.exception()
+            else:
+                results[ip] = task.result()
+        return results
+
+    def compare(self, device, neighbours):
+        """Yields a row for every interface of device netbox or LLDP knows
+        a remote of"""
+        ifaces = self.interfaces(device)
+        for ifname in sorted(set(ifaces) | set(neighbours), key=name_to_tuple):
+            iface = ifaces.get(ifname)
+            lldp = neighbours.get(ifname)
+            row = dict((f, None) for f in AUDIT_FIELDS)
+            row.update(device=device, interface=ifname)
+
+            if iface is not None:
+                if iface["type"]["label"] in SKIP_IFACE_TYPES:
+                    continue
+                endpoint = (iface.get("connected_endpoints") or [{}])[0]
+                row["netbox_device"] = (endpoint.get("device") or {}).get("name")
+                row["netbox_port"] = endpoint.get("name")
+            if lldp is not None:
+                row["lldp_device"] = lldp["remote_name"]
+                row["lldp_port"] = lldp["remote_port"]
+
+            if row["netbox_device"] is None and row["lldp_device"] is None:
+                continue
+            if iface is None:
+                row["status"] = "unknown_interface"
+            elif lldp is None:
+                row["status"] = "no_lldp"
+            elif row["netbox_device"] is None:
+                row["status"] = "no_cable"
+            elif row["netbox_device"] != row["lldp_device"]:
+                row["status"] = "wrong_device"
+            elif row["lldp_port"] != row["netbox_port"] and self._known_port(
+                row["lldp_device"], row["lldp_port"]
+            ):
+                row["status"] = "wrong_port"
+            else:
+                row["status"] = "ok"
+            yield row
+
+    def run(self, devices, deadline):
+        """Audits [(name, snmp ip)], returns the rows of all devices"""
+        results = asyncio.run(self.walk([ip for name, ip in devices], deadline))
+        rows = []
+        for name, snmpip in devices:
+            neighbours = results[snmpip]
+            if isinstance(neighbours, Exception):
+                row = dict((f, None) for f in AUDIT_FIELDS)
+                row.update(
+                    device=name,
+                    status="unreachable",
+                    error="%s: %s" % (type(neighbours).__name__, neighbours),
+                )
+                rows.append(row)
+                continue
+            rows.extend(self.compare(name, neighbours))
+        return rows
+
+
+def write_audit(rows, out, fmt="json"):
+    """Writes audit rows to the file out as json or csv"""
+    if fmt == "csv":
+        writer = csv.DictWriter(out, AUDIT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        json.dump(rows, out, indent=2)
+        out.write("\n")
@@ -0,0 +1,81 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+DEFAULT_SNMP_CACHE = "~/.cache/imfcfg/snmp.sqlite"
+
+# expired entries are deleted every this many writes
+EXPIRE_EVERY = 100
+
+
+class SnmpCache(object):
+    """Cache of walked SNMP tables in a sqlite database
+
+    The database runs in WAL mode, so any number of processes and threads
+    read in parallel while one of them writes. Tables are stored pickled
+    with their expiry time, expired entries are never returned and are
+    deleted as new tables are written.
+    """
+
+    def __init__(self, path, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS snmp_tables "
+                "(key TEXT PRIMARY KEY, expires REAL, data BLOB)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Returns the cached table of key, None if missing or expired"""
+        row = (
+            self._conn()
+            .execute(
+                "SELECT data FROM snmp_tables WHERE key = ? AND expires > ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key, table, ttl):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO snmp_tables (key, expires, data) VALUES (?, ?, ?)",
+            (key, now + ttl, pickle.dumps(table, pickle.HIGHEST_PROTOCOL)),
+        )
+        self._writes += 1
+        if self._writes % EXPIRE_EVERY == 0:
+            self.expire(now)
+
+    def expire(self, now=None):
+        """Deletes all expired entries"""
+        self._conn().execute(
+            "DELETE FROM snmp_tables WHERE expires <= ?",
+            (now if now is not None else time.time(),),
+        )
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,370 @@
+import asyncio
+import itertools
+import random
+import weakref
+
+# BER tags
+TAG_INTEGER = 0x02
+TAG_OCTET_STRING = 0x04
+TAG_NULL = 0x05
+TAG_OID = 0x06
+TAG_SEQUENCE = 0x30
+TAG_IPADDRESS = 0x40
+TAG_COUNTER32 = 0x41
+TAG_GAUGE32 = 0x42
+TAG_TIMETICKS = 0x43
+TAG_OPAQUE = 0x44
+TAG_COUNTER64 = 0x46
+TAG_NO_SUCH_OBJECT = 0x80
+TAG_NO_SUCH_INSTANCE = 0x81
+TAG_END_OF_MIB_VIEW = 0x82
+
+PDU_GET = 0xA0
+PDU_GETNEXT = 0xA1
+PDU_RESPONSE = 0xA2
+PDU_GETBULK = 0xA5
+
+SNMP_VERSION_2C = 1
+
+
+class SnmpError(Exception):
+    pass
+
+
+class SnmpTimeout(SnmpError):
+    pass
+
+
+def _encode_length(n):
+    if n < 0x80:
+        return bytes([n])
+    out = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(out)]) + out
+
+
+def encode_tlv(tag, payload):
+    return bytes([tag]) + _encode_length(len(payload)) + payload
+
+
+def encode_int(value, tag=TAG_INTEGER):
+    length = max(1, (value.bit_length() + 8) // 8)
+    return encode_tlv(tag, value.to_bytes(length, "big", signed=True))
+
+
+def encode_unsigned(value, tag):
+    # unsigned types get a leading zero byte if the high bit is set
+    length = max(1, (value.bit_length() + 8) // 8)
+    return encode_tlv(tag, value.to_bytes(length, "big"))
+
+
+def encode_oid(oid):
+    oid = tuple(oid)
+    if len(oid) < 2:
+        oid = oid + (0,) * (2 - len(oid))
+    out = bytearray([oid[0] * 40 + oid[1]])
+    for sub in oid[2:]:
+        chunk = [sub & 0x7F]
+        sub >>= 7
+        while sub:
+            chunk.append(0x80 | (sub & 0x7F))
+            sub >>= 7
+        out.extend(reversed(chunk))
+    return encode_tlv(TAG_OID, bytes(out))
+
+
+def encode_sequence(*items, tag=TAG_SEQUENCE):
+    return encode_tlv(tag, b"".join(items))
+
+
+def decode_tlv(data, pos=0):
+    """Returns (tag, payload, next position) of the TLV at pos"""
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        length = int.from_bytes(data[pos : pos + n], "big")
+        pos += n
+    end = pos + length
+    if end > len(data):
+        raise SnmpError("truncated BER data")
+    return tag, data[pos:end], end
+
+
+def decode_sequence(data):
+    items = []
+    pos = 0
+    while pos < len(data):
+        tag, payload, pos = decode_tlv(data, pos)
+        items.append((tag, payload))
+    return items
+
+
+def decode_int(payload):
+    return int.from_bytes(payload, "big", signed=True)
+
+
+def decode_oid(payload):
+    first = payload[0]
+    oid = [first // 40, first % 40] if first < 80 else [2, first - 80]
+    sub = 0
+    for b in payload[1:]:
+        sub = (sub << 7) | (b & 0x7F)
+        if not b & 0x80:
+            oid.append(sub)
+            sub = 0
+    return tuple(oid)
+
+
+def parse_oid(oid):
+    if isinstance(oid, str):
+        return tuple(int(i) for i in oid.strip(".").split("."))
+    return tuple(oid)
+
+
+def format_oid(oid):
+    return "." + ".".join(str(i) for i in oid)
+
+
+def _printable(raw):
+    return all(0x20 <= b < 0x7F or b in b"\t\n\v\f\r" for b in raw)
+
+
+def _format_timeticks(ticks):
+    days, rest = divmod(ticks, 8640000)
+    hours, rest = divmod(rest, 360000)
+    minutes, rest = divmod(rest, 6000)
+    seconds, centis = divmod(rest, 100)
+    clock = "%d:%02d:%02d.%02d" % (hours, minutes, seconds, centis)
+    if days:
+        clock = "%d day%s, %s" % (days, "" if days == 1 else "s", clock)
+    return "(%d) %s" % (ticks, clock)
+
+
+def format_value(tag, payload):
+    """Returns (type, value) of a varbind value the way snmpwalk -On prints
+    them, split at the first ": " like _snmp_get_table always did"""
+    if tag == TAG_INTEGER:
+        return "INTEGER", str(decode_int(payload))
+    if tag == TAG_OCTET_STRING:
+        if len(payload) == 0:
+            return "STRING", '""'
+        if _printable(payload):
+            text = payload.decode("latin-1")
+            return "STRING", '"%s"' % text.replace("\\", "\\\\").replace('"', '\\"')
+        return "Hex-STRING", "".join("%02X " % b for b in payload)
+    if tag == TAG_NULL:
+        return "STRING", "NULL"
+    if tag == TAG_OID:
+        return "OID", format_oid(decode_oid(payload))
+    if tag == TAG_IPADDRESS:
+        return "IpAddress", ".".join(str(b) for b in payload)
+    if tag == TAG_COUNTER32:
+        return "Counter32", str(int.from_bytes(payload, "big"))
+    if tag == TAG_GAUGE32:
+        return "Gauge32", str(int.from_bytes(payload, "big"))
+    if tag == TAG_TIMETICKS:
+        return "Timeticks", _format_timeticks(int.from_bytes(payload, "big"))
+    if tag == TAG_COUNTER64:
+        return "Counter64", str(int.from_bytes(payload, "big"))
+    if tag == TAG_OPAQUE:
+        return "OPAQUE", "".join("%02X " % b for b in payload)
+    raise SnmpError("unsupported value type 0x%02x" % (tag,))
+
+
+def encode_message(community, pdu_tag, request_id, a, b, varbinds):
+    """Encodes a v2c message, a/b are error-status/error-index, or
+    non-repeaters/max-repetitions for GETBULK"""
+    return encode_sequence(
+        encode_int(SNMP_VERSION_2C),
+        encode_tlv(TAG_OCTET_STRING, community.encode("utf-8")),
+        encode_sequence(
+            encode_int(request_id),
+            encode_int(a),
+            encode_int(b),
+            encode_sequence(
+                *[encode_sequence(encode_oid(oid), value) for oid, value in varbinds]
+            ),
+            tag=pdu_tag,
+        ),
+    )
+
+
+def decode_message(data):
+    """Returns (community, pdu tag, request id, a, b, [(oid, tag, payload)])"""
+    tag, message, _ = decode_tlv(data)
+    if tag != TAG_SEQUENCE:
+        raise SnmpError("not an SNMP message")
+    items = decode_sequence(message)
+    if len(items) != 3 or decode_int(items[0][1]) != SNMP_VERSION_2C:
+        raise SnmpError("not an SNMP v2c message")
+    community = items[1][1].decode("utf-8", "replace")
+    pdu_tag, pdu = items[2]
+    fields = decode_sequence(pdu)
+    if len(fields) != 4:
+        raise SnmpError("malformed PDU")
+    varbinds = []
+    for _, varbind in decode_sequence(fields[3][1]):
+        (oid_tag, oid), (value_tag, value) = decode_sequence(varbind)
+        varbinds.append((decode_oid(oid), value_tag, value))
+    return (
+        community,
+        pdu_tag,
+        decode_int(fields[0][1]),
+        decode_int(fields[1][1]),
+        decode_int(fields[2][1]),
+        varbinds,
+    )
+
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = decode_message(data)
+        except (SnmpError, IndexError, ValueError):
+            return
+        future = self.pending.pop(msg[2], None)
+        if future is not None and not future.done():
+            future.set_result(msg)
+
+    def error_received(self, exc):
+        # ICMP errors (port unreachable while the agent restarts) are ignored
+        # like snmpwalk does, the request times out and is sent again
+        pass
+
+
+class SnmpClient(object):
+    """asyncio SNMP v2c client walking tables with GETBULK
+
+    Timeouts are per request, a request is sent retries more times before
+    the walk fails with SnmpTimeout. At most concurrency walks run at the
+    same time, so many devices can be walked from one event loop.
+    """
+
+    def __init__(
+        self,
+        community,
+        timeout=2.0,
+        retries=2,
+        max_repetitions=25,
+        port=161,
+        concurrency=64,
+    ):
+        self.community = community
+        self.timeout = timeout
+        self.retries = retries
+        self.max_repetitions = max_repetitions
+        self.port = port
+        self.concurrency = concurrency
+        self._ids = itertools.count(random.randrange(1, 1 << 30))
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self):
+        # semaphores belong to the event loop they were created in
+        loop = asyncio.get_running_loop()
+        sem = self._semaphores.get(loop)
+        if sem is None:
+            sem = self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return sem
+
+    async def _request(self, protocol, pdu_tag, a, b, varbinds):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            request_id = next(self._ids) & 0x7FFFFFFF
+            future = protocol.pending[request_id] = loop.create_future()
+            protocol.transport.sendto(
+                encode_message(self.community, pdu_tag, request_id, a, b, varbinds)
+            )
+            try:
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                protocol.pending.pop(request_id, None)
+        raise SnmpTimeout("no response after %d tries" % (self.retries + 1,))
+
+    async def walk(self, host, oid):
+        """Returns [(oid, type, value)] of everything below oid"""
+        root = parse_oid(oid)
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            transport, protocol = await loop.create_datagram_endpoint(
+                _ClientProtocol, remote_addr=(host, self.port)
+            )
+            try:
+                return await self._walk(protocol, root)
+            finally:
+                transport.close()
+
+    async def _walk(self, protocol, root):
+        rows = []
+        current = root
+        while True:
+            msg = await self._request(
+                protocol,
+                PDU_GETBULK,
+                0,
+                self.max_repetitions,
+                [(current, encode_tlv(TAG_NULL, b""))],
+            )
+            error_status, error_index, varbinds = msg[3], msg[4], msg[5]
+            if error_status != 0:
+                raise SnmpError(
+                    "error-status %d at index %d" % (error_status, error_index)
+                )
+            if not varbinds:
+                return rows
+            for oid, tag, payload in varbinds:
+                if tag == TAG_END_OF_MIB_VIEW or oid[: len(root)] != root:
+                    return rows
+                if oid <= current:
+                    raise SnmpError("OID not increasing: %s" % (format_oid(oid),))
+                current = oid
+                if tag in (TAG_NO_SUCH_OBJECT, TAG_NO_SUCH_INSTANCE):
+                    continue
+                rows.append((oid,) + format_value(tag, payload))
+
+    async def get_table(self, host, tableoid, idxlen=1):
+        """Walks tableoid on host, returns {index: {column: (type, value)}}"""
+        return rows_to_table(await self.walk(host, tableoid), tableoid, idxlen)
+
+    async def get_tables(self, requests):
+        """Walks [(host, tableoid, idxlen)] concurrently, returns one table
+        or exception per request"""
+        return await asyncio.gather(
+            *[self.get_table(*r) for r in requests], return_exceptions=True
+        )
+
+    def get_table_sync(self, host, tableoid, idxlen=1):
+        return asyncio.run(self.get_table(host, tableoid, idxlen))
+
+
+def snmp_client_from_config(config, **kwargs):
+    """Returns a SnmpClient set up by the [snmp] section of config, kwargs
+    override it"""
+    options = dict(
+        timeout=config.getfloat("snmp", "timeout", fallback=2.0),
+        retries=config.getint("snmp", "retries", fallback=2),
+        max_repetitions=config.getint("snmp", "max_repetitions", fallback=25),
+        concurrency=config.getint("snmp", "concurrency", fallback=64),
+        port=config.getint("snmp", "port", fallback=161),
+    )
+    options.update(kwargs)
+    return SnmpClient(config.get("snmp", "community"), **options)
+
+
+def rows_to_table(rows, tableoid, idxlen=1):
+    """Groups walked rows into {index: {column: (type, value)}}, the index is
+    the first idxlen sub-ids after the column"""
+    skip = len(parse_oid(tableoid))
+    table = {}
+    for oid, typ, val in rows:
+        oid = oid[skip:]
+        key, index = oid[0], tuple(oid[1 : 1 + idxlen])
+        table.setdefault(index, {})[key] = (typ, val)
+    return table
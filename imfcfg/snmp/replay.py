@@ -0,0 +1,202 @@
+"""Stand-in SNMP v2c agent replaying recorded walks
+
+Serves GET, GETNEXT and GETBULK from the output of snmpwalk -On, one
+recording per listening address, so SnmpClient can be checked against
+what real devices answered:
+
+    snmpwalk -On0 -v2c -c public 10.0.0.1 .1.0.8802.1.1.2.1 > switch1.walk
+    python -m imfcfg.snmp.replay 127.0.0.2:1161=switch1.walk ...
+"""
+
+import argparse
+import asyncio
+import bisect
+import ipaddress as ipaddr
+import sys
+
+from imfcfg.snmp.client import (
+    PDU_GET,
+    PDU_GETBULK,
+    PDU_GETNEXT,
+    PDU_RESPONSE,
+    TAG_COUNTER32,
+    TAG_COUNTER64,
+    TAG_END_OF_MIB_VIEW,
+    TAG_GAUGE32,
+    TAG_IPADDRESS,
+    TAG_NO_SUCH_OBJECT,
+    TAG_NULL,
+    TAG_OCTET_STRING,
+    TAG_TIMETICKS,
+    SnmpError,
+    decode_message,
+    encode_int,
+    encode_message,
+    encode_oid,
+    encode_tlv,
+    encode_unsigned,
+    parse_oid,
+)
+
+# PDUs larger than this are cut short like agents do
+MAX_RESPONSE_VARBINDS = 100
+
+
+def _unquote(val):
+    out = []
+    chars = iter(val[1:-1])
+    for c in chars:
+        if c == "\\":
+            c = next(chars, "")
+        out.append(c)
+    return "".join(out).encode("latin-1")
+
+
+def encode_value(typ, val):
+    """Encodes a value as printed by snmpwalk back to BER"""
+    if typ == "STRING":
+        if val == "NULL":
+            return encode_tlv(TAG_NULL, b"")
+        return encode_tlv(TAG_OCTET_STRING, _unquote(val))
+    if typ in ("Hex-STRING", "OPAQUE"):
+        return encode_tlv(TAG_OCTET_STRING, bytes.fromhex(val.strip('"')))
+    if typ == "INTEGER":
+        # enums are printed as name(number) with MIBs loaded
+        if val.endswith(")"):
+            val = val.rsplit("(", 1)[1][:-1]
+        return encode_int(int(val))
+    if typ == "OID":
+        return encode_oid(parse_oid(val))
+    if typ == "IpAddress":
+        return encode_tlv(TAG_IPADDRESS, ipaddr.IPv4Address(val).packed)
+    if typ in ("Counter32", "Gauge32", "Counter64"):
+        tag = {
+            "Counter32": TAG_COUNTER32,
+            "Gauge32": TAG_GAUGE32,
+            "Counter64": TAG_COUNTER64,
+        }[typ]
+        return encode_unsigned(int(val.split()[0]), tag)
+    if typ == "Timeticks":
+        return encode_unsigned(int(val.split(")")[0].lstrip("(")), TAG_TIMETICKS)
+    raise ValueError("unsupported type %r" % (typ,))
+
+
+def load_walk(lines):
+    """Returns the sorted [(oid, encoded value)] of snmpwalk -On output"""
+    rows = []
+    for line in lines:
+        line = line.rstrip("\n")
+        if " = " not in line:
+            continue
+        oid, value = line.split(" = ", 1)
+        if ":" in value:
+            typ, val = value.split(": ", 1)
+        else:
+            typ, val = "STRING", value
+        if val.startswith("No Such") or val.startswith("No more variables"):
+            continue
+        rows.append((parse_oid(oid), encode_value(typ, val)))
+    rows.sort()
+    return rows
+
+
+class ReplayAgent(asyncio.DatagramProtocol):
+    def __init__(self, rows, community=None):
+        self.rows = rows
+        self.oids = [oid for oid, value in rows]
+        self.community = community
+        self.transport = None
+        self.requests = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def _next(self, oid):
+        i = bisect.bisect_right(self.oids, oid)
+        if i >= len(self.rows):
+            return oid, encode_tlv(TAG_END_OF_MIB_VIEW, b"")
+        return self.rows[i]
+
+    def _get(self, oid):
+        i = bisect.bisect_left(self.oids, oid)
+        if i < len(self.rows) and self.oids[i] == oid:
+            return self.rows[i]
+        return oid, encode_tlv(TAG_NO_SUCH_OBJECT, b"")
+
+    def respond(self, msg):
+        community, pdu_tag, request_id, a, b, varbinds = msg
+        oids = [oid for oid, tag, payload in varbinds]
+        out = []
+        if pdu_tag == PDU_GET:
+            out = [self._get(oid) for oid in oids]
+        elif pdu_tag == PDU_GETNEXT:
+            out = [self._next(oid) for oid in oids]
+        elif pdu_tag == PDU_GETBULK:
+            non_repeaters, max_repetitions = max(a, 0), max(b, 0)
+            out = [self._next(oid) for oid in oids[:non_repeaters]]
+            repeaters = oids[non_repeaters:]
+            for i in range(max_repetitions):
+                if not repeaters or len(out) + len(repeaters) > MAX_RESPONSE_VARBINDS:
+                    break
+                row = [self._next(oid) for oid in repeaters]
+                out.extend(row)
+                repeaters = [oid for oid, value in row]
+                if all(value[0] == TAG_END_OF_MIB_VIEW for oid, value in row):
+                    break
+        else:
+            return None
+        return encode_message(community, PDU_RESPONSE, request_id, 0, 0, out)
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = decode_message(data)
+        except (SnmpError, IndexError, ValueError):
+            return
+        if self.community is not None and msg[0] != self.community:
+            return
+        self.requests += 1
+        response = self.respond(msg)
+        if response is not None:
+            self.transport.sendto(response, addr)
+
+
+async def start_agent(host, port, rows, community=None):
+    """Starts serving rows on host:port, returns (transport, agent)"""
+    loop = asyncio.get_running_loop()
+    return await loop.create_datagram_endpoint(
+        lambda: ReplayAgent(rows, community), local_addr=(host, port)
+    )
+
+
+async def _serve(recordings, community):
+    for (host, port), rows in recordings:
+        await start_agent(host, port, rows, community)
+        sys.stderr.write("replaying %d oids on %s:%d\n" % (len(rows), host, port))
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay recorded SNMP walks")
+    parser.add_argument(
+        "recordings",
+        nargs="+",
+        metavar="HOST:PORT=WALKFILE",
+        help="snmpwalk -On output",
+    )
+    parser.add_argument("-c", dest="community", default=None)
+    args = parser.parse_args()
+
+    recordings = []
+    for arg in args.recordings:
+        addr, path = arg.split("=", 1)
+        host, port = addr.rsplit(":", 1)
+        with open(path, "r") as f:
+            recordings.append(((host, int(port)), load_walk(f)))
+    try:
+        asyncio.run(_serve(recordings, args.community))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
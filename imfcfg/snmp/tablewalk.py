@@ -1,57 +1,109 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+
+from imfcfg.snmp.cache import DEFAULT_SNMP_CACHE, SnmpCache
+from imfcfg.snmp.client import snmp_client_from_config
+
 lldp_rem_table = ".1.0.8802.1.1.2.1.4.1.1"
 lldp_loc_table = ".1.0.8802.1.1.2.1.3.7.1"
 if_table_oper = ".1.3.6.1.2.1.2.2.1.8"
 ifx_table = ".1.3.6.1.2.1.31.1.1.1"
 
+# names of the tables in the [snmp] cachetime_<name> options
+SNMP_TABLE_NAMES = {
+    lldp_rem_table: "lldp_rem",
+    lldp_loc_table: "lldp_loc",
+    if_table_oper: "if_oper",
+    ifx_table: "ifx",
+}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def snmp_cache_from_config(config):
+    """Returns the SnmpCache at [snmp] cache_path, shared within the process"""
+    path = os.path.expanduser(
+        config.get("snmp", "cache_path", fallback=DEFAULT_SNMP_CACHE)
+    )
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = SnmpCache(path)
+    return cache
+
+
+def snmp_cachetime(config, tableoid):
+    """Returns how long walks of tableoid are cached, [snmp] cachetime_<name>
+    with the table names of SNMP_TABLE_NAMES, or cachetime"""
+    default = config.getfloat("snmp", "cachetime", fallback=30.0)
+    name = SNMP_TABLE_NAMES.get(tableoid)
+    if name is None:
+        return default
+    return config.getfloat("snmp", "cachetime_%s" % (name,), fallback=default)
+
+
+class CachedSnmpClient(object):
+    """Walks tables with a SnmpClient unless the SnmpCache still has them
+
+    Walked tables are cached for cachetime(tableoid) seconds. Has the
+    get_table and get_tables of SnmpClient, failed walks are not cached.
+    """
+
+    def __init__(self, client, cache, cachetime, trace=False):
+        self.client = client
+        self.cache = cache
+        self.cachetime = cachetime
+        self.trace = trace
+
+    async def get_table(self, host, tableoid, idxlen=1):
+        """Returns {index: {column: (type, value)}} of tableoid on host"""
+        cachekey = json.dumps([host, tableoid, idxlen])
+        table = self.cache.get(cachekey)
+        if table is not None:
+            if self.trace:
+                sys.stderr.write("SNMP CACHE: %s %s\n" % (host, tableoid))
+            return table
+        if self.trace:
+            sys.stderr.write("SNMP WALK: %s %s\n" % (host, tableoid))
+        table = await self.client.get_table(host, tableoid, idxlen)
+        self.cache.put(cachekey, table, self.cachetime(tableoid))
+        return table
+
+    async def get_tables(self, requests):
+        """Returns a table or the exception of the failed walk for every
+        (host, tableoid, idxlen) of requests, walked concurrently"""
+        return await asyncio.gather(
+            *[self.get_table(*r) for r in requests], return_exceptions=True
+        )
 
-def _snmp_get_table(cache, snmpip, tableoid, idxlen):
-    data = None
-    cachekey = json.dumps([snmpip, tableoid, idxlen]).encode("UTF-8")
-    if cachekey in cache:
-        cached = json.loads(cache[cachekey].decode("UTF-8"))
-        if time.time() < cached.get("ts", 0) + config.get(
-            "snmp", "cachetime", fallback=30.0
-        ):
-            data = cached["data"]
-
-    if data is None:
-        community = config.get("snmp", "community")
-        if args.trace:
-            sys.stderr.write("SNMP WALK: %s %s\n" % (snmpip, tableoid))
-        data = subprocess.check_output(
-            "snmpwalk -On0 -v2c -c".split() + [community, snmpip, tableoid]
-        ).decode("UTF-8")
-        cache[cachekey] = json.dumps({"ts": time.time(), "data": data}).encode("UTF-8")
-    else:
-        if args.trace:
-            sys.stderr.write("SNMP CACHE: %s %s\n" % (snmpip, tableoid))
-
-    tableoid = [int(i) for i in tableoid.lstrip(".").split(".")]
-    table = {}
-    for line in data.splitlines():
-        oid, line = line.split(" = ", 1)
-        if ":" in line:
-            typ, val = line.split(": ", 1)
-        else:
-            typ, val = "STRING", line
 
-        oid = [int(i) for i in oid.lstrip(".").split(".")]
-        assert oid[: len(tableoid)] == tableoid
-        oid = oid[len(tableoid) :]
-        key, index = oid[0], tuple(oid[1 : 1 + idxlen])
+def snmp_cached_client_from_config(config, trace=False, **kwargs):
+    """Returns a CachedSnmpClient set up by the [snmp] section of config,
+    kwargs override the SnmpClient options"""
+    return CachedSnmpClient(
+        snmp_client_from_config(config, **kwargs),
+        snmp_cache_from_config(config),
+        lambda tableoid: snmp_cachetime(config, tableoid),
+        trace,
+    )
 
-        item = table.setdefault(index, {})
-        item[key] = (typ, val)
-    return table
 
+def snmp_get_tables(config, requests, trace=False):
+    """Walks [(snmpip, tableoid, idxlen)] concurrently, returns a table or
+    the exception of the failed walk for every request"""
+    client = snmp_cached_client_from_config(config, trace)
+    return asyncio.run(client.get_tables(requests))
 
-def snmp_get_table(snmpip, tableoid, idxlen=1):
-    dbpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lldp.cache")
-    dblock = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lldp.cache.lock")
-    with open(dblock, "w") as lockfd:
-        fcntl.lockf(lockfd.fileno(), fcntl.LOCK_EX)
-        with dbm.gnu.open(dbpath, "c") as cache:
-            return _snmp_get_table(cache, snmpip, tableoid, idxlen)
+
+def snmp_get_table(config, snmpip, tableoid, idxlen=1, trace=False):
+    table = snmp_get_tables(config, [(snmpip, tableoid, idxlen)], trace)[0]
+    if isinstance(table, Exception):
+        raise table
+    return table
 
 
 def snmp_value(data, oid):
@@ -66,17 +118,8 @@ def snmp_value(data, oid):
     return raw[1]
 
 
-def device_snmp_lldp_neigh(snmpip):
+def lldp_ports(rem_table, loc_table):
     ports = {}
-
-    try:
-        rem_table = snmp_get_table(snmpip, lldp_rem_table, 3)
-        loc_table = snmp_get_table(snmpip, lldp_loc_table)
-    except subprocess.CalledProcessError:
-        return ports
-    except FileNotFoundError:
-        return ports
-
     for index, vals in rem_table.items():
         loc_port = loc_table[(index[1],)]
         loc_port_id = snmp_value(loc_port, 3)
@@ -101,21 +144,29 @@ def device_snmp_lldp_neigh(snmpip):
     return ports
 
 
-def device_interface_status(devname):
-    tvars = {}
-    device, ip4, ip6 = loadDeviceData(tvars, devname)
-    snmpip = ip4.split("/")[0]
+def devices_snmp_lldp_neigh(config, snmpips):
+    """Returns snmpip -> lldp neighbours for all snmpips, walked at once"""
+    tables = snmp_get_tables(
+        config,
+        [(ip, lldp_rem_table, 3) for ip in snmpips]
+        + [(ip, lldp_loc_table, 1) for ip in snmpips],
+    )
+    neighbours = {}
+    for i, snmpip in enumerate(snmpips):
+        rem_table, loc_table = tables[i], tables[len(snmpips) + i]
+        if isinstance(rem_table, Exception) or isinstance(loc_table, Exception):
+            neighbours[snmpip] = {}
+            continue
+        neighbours[snmpip] = lldp_ports(rem_table, loc_table)
+    return neighbours
 
-    ports = {}
 
-    try:
-        if_table = snmp_get_table(snmpip, ifx_table)
-        oper_table = snmp_get_table(snmpip, if_table_oper, 0)
-    except subprocess.CalledProcessError:
-        return ports
-    except FileNotFoundError:
-        return ports
+def device_snmp_lldp_neigh(config, snmpip):
+    return devices_snmp_lldp_neigh(config, [snmpip])[snmpip]
 
+
+def interface_ports(if_table, oper_table):
+    ports = {}
     for index, vals in if_table.items():
         if_name = snmp_value(vals, 1)
         if_speed = int(snmp_value(vals, 15))
@@ -145,12 +196,39 @@ def device_interface_status(devname):
     return ports
 
 
-def device_pair_lldp(devname):
+def devices_interface_status(config, devnames):
+    """Returns devname -> interface status for all devnames, walked at once"""
+    snmpips = []
+    for devname in devnames:
+        tvars = {}
+        device, ip4, ip6 = loadDeviceData(tvars, devname)
+        snmpips.append(ip4.split("/")[0])
+
+    tables = snmp_get_tables(
+        config,
+        [(ip, ifx_table, 1) for ip in snmpips]
+        + [(ip, if_table_oper, 0) for ip in snmpips],
+    )
+    status = {}
+    for i, devname in enumerate(devnames):
+        if_table, oper_table = tables[i], tables[len(devnames) + i]
+        if isinstance(if_table, Exception) or isinstance(oper_table, Exception):
+            status[devname] = {}
+            continue
+        status[devname] = interface_ports(if_table, oper_table)
+    return status
+
+
+def device_interface_status(config, devname):
+    return devices_interface_status(config, [devname])[devname]
+
+
+def device_pair_lldp(config, devname):
     tvars = {}
     device, ip4, ip6 = loadDeviceData(tvars, devname)
     snmpip = ip4.split("/")[0]
 
-    ifs_lldp = device_snmp_lldp_neigh(snmpip)
+    ifs_lldp = device_snmp_lldp_neigh(config, snmpip)
     ifs_netbox = nb.int_by_device_name(devname)
     ifs_netbox = dict((i["name"], i) for i in ifs_netbox)
 
@@ -194,7 +272,7 @@ def device_pair_lldp(devname):
         yield ifname, if_netbox, remote, remote_port, descr, if_lldp, lldp_target_id
 
 
-def device_sync_lldp(devname):
+def device_sync_lldp(config, devname):
     for (
         ifname,
         if_netbox,
@@ -203,7 +281,7 @@ def device_sync_lldp(devname):
         descr,
         if_lldp,
         lldp_target_id,
-    ) in device_pair_lldp(devname):
+    ) in device_pair_lldp(config, devname):
         netbox_device, lldp_device = None, None
 
         if if_netbox is not None:
@@ -1 +1,2 @@
 from .util import *
+from .iphelper import *
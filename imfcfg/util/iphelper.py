@@ -0,0 +1,83 @@
+import ipaddress as ipaddr
+from functools import lru_cache
+
+# parsed interfaces and computed results are immutable ipaddress objects, so
+# they are shared between all calls and renders
+CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_interface(value):
+    """Returns ipaddress.ip_interface(value), cached by string"""
+    return ipaddr.ip_interface(value)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_network(value):
+    """Returns ipaddress.ip_network(value), cached by string"""
+    return ipaddr.ip_network(value)
+
+
+def host_range(network):
+    """Returns (first, last) address of network.hosts() as integers"""
+    first = int(network.network_address)
+    last = int(network.broadcast_address)
+    if network.prefixlen >= network.max_prefixlen - 1:
+        # point to point and host networks use every address
+        return first, last
+    if network.version == 4:
+        return first + 1, last - 1
+    # ipv6 only skips the subnet router anycast address
+    return first + 1, last
+
+
+def nth_host(network, n):
+    """Returns the n-th (1 based) address of network.hosts()"""
+    first, last = host_range(network)
+    if first + n - 1 > last:
+        raise ValueError("%s has less than %d hosts" % (network, n))
+    return network._address_class(first + n - 1)
+
+
+def net2ip(n):
+    """Returns the first IP in a given network"""
+    return parse_interface(str(n)).ip
+
+
+def nin(n1, n2):
+    """Returns True if n1 is a subnet of (or equal to) n2"""
+    return parse_network(str(n1)) in parse_network(str(n2))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _nethost(net, addr, offset, nomask, mask):
+    net = parse_interface(net)
+    prefixlen = net.network.prefixlen
+
+    if addr == 0:
+        net = parse_interface(f"{net.network.network_address}/{prefixlen}")
+    elif addr is not None:
+        if addr < 0:
+            # hosts[addr - 1] of an empty list
+            raise IndexError("list index out of range")
+        if prefixlen == net.max_prefixlen:
+            # next() on the list hosts() returns for host networks
+            raise TypeError("'list' object is not an iterator")
+        net = parse_interface(f"{nth_host(net.network, addr)}/{prefixlen}")
+
+    if offset is not None:
+        net = net + offset
+
+    if nomask:
+        return net.ip
+    if mask:
+        return net.netmask
+    return net
+
+
+def nethost(net, addr=None, offset=None, nomask=False, mask=False):
+    """jinja2 filter to mangle IP prefixes, addr to the new offset inside the network
+    Offset add this offset to the current address, nomask don't print with the network mask, if mask is true
+    return the mask and not the address.
+    """
+    return _nethost(str(net), addr, offset, nomask, mask)
@@ -4,48 +4,6 @@ import ipaddress as ipaddr
 import passlib.hash
 
 
-def net2ip(n):
-    """Returns the first IP in a given network"""
-    net = ipaddr.ip_interface(n)
-    return net.ip
-
-
-def nin(n1, n2):
-    """Returns True if n1 is a subnet of (or equal to) n2"""
-    return ipaddr.ip_network(n1) in ipaddr.ip_network(n2)
-
-
-def nethost(net, addr=None, offset=None, nomask=False, mask=False):
-    """jinja2 filter to mangle IP prefixes, addr to the new offset inside the network
-    Offset add this offset to the current address, nomask don't print with the network mask, if mask is true
-    return the mask and not the address.
-    """
-    net = ipaddr.ip_interface(str(net))
-
-    if addr == 0:
-        net = ipaddr.ip_interface(
-            f"{net.network.network_address}/{net.network.prefixlen}"
-        )
-    elif addr is not None:
-        if addr == 1:
-            net = ipaddr.ip_interface(
-                f"{next(net.network.hosts())}/{net.network.prefixlen}"
-            )
-        else:
-            generator = net.network.hosts()
-            hosts = [next(generator) for _ in range(addr)]
-            net = ipaddr.ip_interface(f"{hosts[addr-1]}/{net.network.prefixlen}")
-
-    if offset is not None:
-        net = net + offset
-
-    if nomask:
-        return net.ip
-    if mask:
-        return net.netmask
-    return net
-
-
 def is_junos_els(dev):
     if dev["device_type"]["slug"].startswith("ex2300"):
         return True
@@ -74,6 +32,49 @@ def to_dict(v):
     return v.to_dict() if hasattr(v, "to_dict") else v
 
 
+def _readonly(self, *args, **kwargs):
+    raise TypeError("%s is read-only" % (self.__class__.__name__,))
+
+
+class FrozenDict(dict):
+    """dict that refuses modification, for data shared between renders"""
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class FrozenList(list):
+    """list that refuses modification, for data shared between renders"""
+
+    __setitem__ = __delitem__ = _readonly
+    append = extend = insert = pop = remove = reverse = sort = clear = _readonly
+    __iadd__ = __imul__ = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(v):
+    """Returns a read-only copy of nested dicts and lists"""
+    if isinstance(v, dict):
+        return FrozenDict((k, freeze(v)) for k, v in v.items())
+    if isinstance(v, list):
+        return FrozenList(freeze(v) for v in v)
+    if isinstance(v, set):
+        return frozenset(v)
+    return v
+
+
 JUNOS_SSH_OUTDATED_PLATFORMS = [
     "ex2200",
     "ex3200",
@@ -82,6 +83,16 @@ JUNOS_SSH_OUTDATED_PLATFORMS = [
 ]
 
 
+def supports_patch(dev):
+    """Returns True for devices whose configs can be sent as load replace
+    patches: Junos devices, by netbox platform or device type manufacturer"""
+    platform = (dev.get("platform") or {}).get("slug")
+    if platform:
+        return platform.startswith("junos")
+    device_type = dev.get("device_type") or {}
+    return (device_type.get("manufacturer") or {}).get("slug") == "juniper"
+
+
 def is_junos_ssh_outdated(dev):
     dev_type = dev["device_type"]["slug"]
     for m in JUNOS_SSH_OUTDATED_PLATFORMS:
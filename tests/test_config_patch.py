@@ -0,0 +1,67 @@
+from imfcfg.render.cache import ConfigHistory, RenderedConfig
+from imfcfg.util import supports_patch
+
+EOS_DEVICE = {
+    "name": "sw1",
+    "platform": {"slug": "eos"},
+    "device_type": {"slug": "dcs-7050sx3", "manufacturer": {"slug": "arista"}},
+}
+JUNOS_DEVICE = {
+    "name": "sw1",
+    "platform": None,
+    "device_type": {"slug": "ex2300-48p", "manufacturer": {"slug": "juniper"}},
+}
+
+EOS_CONFIG = """hostname %s
+!
+interface Ethernet1
+   description uplink; to core
+!
+"""
+
+JUNOS_CONFIG = """system {
+    host-name %s;
+}
+interfaces {
+    ge-0/0/0 {
+        description "uplink; to core";
+    }
+}
+"""
+
+
+def history_delta(device, template):
+    history = ConfigHistory()
+    old, new = [
+        RenderedConfig("sw1", 1, "sw1.j2", 0, (template % name).encode(), None)
+        for name in ("sw1", "sw2")
+    ]
+    history.add(old)
+    history.add(new)
+    return new, history.delta("sw1", old.etag, new, supports_patch(device))
+
+
+def test_supports_patch():
+    assert not supports_patch(EOS_DEVICE)
+    assert supports_patch(JUNOS_DEVICE)
+    assert supports_patch({"platform": {"slug": "junos-els"}, "device_type": {}})
+    assert not supports_patch({"platform": None, "device_type": {"slug": "x"}})
+
+
+def test_eos_config_is_sent_in_full():
+    rendered, (mode, body) = history_delta(EOS_DEVICE, EOS_CONFIG)
+    assert mode == "full"
+    assert body == rendered.body
+
+
+def test_junos_config_is_patched():
+    rendered, (mode, body) = history_delta(JUNOS_DEVICE, JUNOS_CONFIG)
+    assert mode == "patch"
+    assert body == b"replace:\nsystem {\n    host-name sw2;\n}\n"
+
+
+def test_unknown_base_is_sent_in_full():
+    history = ConfigHistory()
+    rendered = RenderedConfig("sw1", 1, "sw1.j2", 0, JUNOS_CONFIG.encode(), None)
+    history.add(rendered)
+    assert history.delta("sw1", "unknown", rendered, True) == ("full", rendered.body)
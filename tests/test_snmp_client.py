@@ -0,0 +1,139 @@
+import asyncio
+import configparser
+import socket
+
+import pytest
+
+from imfcfg.snmp import client
+from imfcfg.snmp.client import SnmpClient, SnmpTimeout
+from imfcfg.snmp.replay import load_walk, start_agent
+from imfcfg.snmp.tablewalk import ifx_table, snmp_cached_client_from_config
+
+IFENTRY = ".1.3.6.1.2.1.2.2.1"
+
+WALK = """\
+.1.3.6.1.2.1.1.5.0 = STRING: "switch1"
+.1.3.6.1.2.1.2.2.1.1.1 = INTEGER: 1
+.1.3.6.1.2.1.2.2.1.1.2 = INTEGER: 2
+.1.3.6.1.2.1.2.2.1.1.3 = INTEGER: 3
+.1.3.6.1.2.1.2.2.1.2.1 = STRING: "ge-0/0/0"
+.1.3.6.1.2.1.2.2.1.2.2 = STRING: "ge-0/0/1"
+.1.3.6.1.2.1.2.2.1.2.3 = STRING: "ae0"
+.1.3.6.1.2.1.2.2.1.8.1 = INTEGER: up(1)
+.1.3.6.1.2.1.2.2.1.8.2 = INTEGER: down(2)
+.1.3.6.1.2.1.2.2.1.8.3 = INTEGER: up(1)
+.1.3.6.1.2.1.2.2.1.10.1 = Counter32: 1234
+.1.3.6.1.2.1.31.1.1.1.1.1 = STRING: "ge-0/0/0"
+"""
+
+TABLE = {
+    (1,): {
+        1: ("INTEGER", "1"),
+        2: ("STRING", '"ge-0/0/0"'),
+        8: ("INTEGER", "1"),
+        10: ("Counter32", "1234"),
+    },
+    (2,): {1: ("INTEGER", "2"), 2: ("STRING", '"ge-0/0/1"'), 8: ("INTEGER", "2")},
+    (3,): {1: ("INTEGER", "3"), 2: ("STRING", '"ae0"'), 8: ("INTEGER", "1")},
+}
+
+
+def walk_table(walk, oid, **kwargs):
+    """Walks oid of a replay agent serving walk, returns the table and the
+    number of requests the agent answered"""
+
+    async def run():
+        transport, agent = await start_agent(
+            "127.0.0.1", 0, load_walk(walk.splitlines()), "public"
+        )
+        try:
+            port = transport.get_extra_info("sockname")[1]
+            snmp = SnmpClient("public", timeout=1.0, retries=0, port=port, **kwargs)
+            return await snmp.get_table("127.0.0.1", oid), agent.requests
+        finally:
+            transport.close()
+
+    return asyncio.run(run())
+
+
+def test_get_table():
+    table, requests = walk_table(WALK, IFENTRY)
+    assert table == TABLE
+    assert requests == 1
+
+
+def test_get_table_max_repetitions():
+    # one row per GETBULK, the walk continues until it leaves the table
+    table, requests = walk_table(WALK, IFENTRY, max_repetitions=1)
+    assert table == TABLE
+    assert requests == 11
+
+
+def test_walk_ends_at_end_of_mib():
+    # the table is the last thing the agent has
+    walk = "".join(line + "\n" for line in WALK.splitlines() if ".31.1.1" not in line)
+    table, requests = walk_table(walk, IFENTRY, max_repetitions=4)
+    assert table == TABLE
+    assert requests == 3
+
+
+def test_walk_of_missing_table():
+    table, requests = walk_table(WALK, ".1.3.6.1.2.1.4.20")
+    assert table == {}
+
+
+def test_cached_client(tmp_path):
+    config = configparser.ConfigParser()
+    config.read_dict(
+        {
+            "snmp": {
+                "community": "public",
+                "cache_path": str(tmp_path / "snmp.sqlite"),
+                "cachetime_ifx": "0",
+            }
+        }
+    )
+
+    async def run():
+        transport, agent = await start_agent(
+            "127.0.0.1", 0, load_walk(WALK.splitlines()), "public"
+        )
+        try:
+            port = transport.get_extra_info("sockname")[1]
+            snmp = snmp_cached_client_from_config(config, port=port, retries=0)
+            tables = [await snmp.get_table("127.0.0.1", IFENTRY) for _ in range(2)]
+            requests = agent.requests
+            # not cached at all
+            for _ in range(2):
+                await snmp.get_table("127.0.0.1", ifx_table)
+            return tables, requests, agent.requests - requests
+        finally:
+            transport.close()
+
+    tables, requests, ifx_requests = asyncio.run(run())
+    assert tables == [TABLE, TABLE]
+    assert requests == 1
+    assert ifx_requests == 2
+
+
+def test_timeout(monkeypatch):
+    # a port nothing listens on
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    sent = []
+    encode_message = client.encode_message
+
+    def counting_encode_message(*args):
+        sent.append(args[2])
+        return encode_message(*args)
+
+    monkeypatch.setattr(client, "encode_message", counting_encode_message)
+    snmp = SnmpClient("public", timeout=0.1, retries=2, port=port)
+    with pytest.raises(SnmpTimeout):
+        snmp.get_table_sync("127.0.0.1", IFENTRY)
+    assert len(sent) == 3
+    # every try is a new request
+    assert len(set(sent)) == 3